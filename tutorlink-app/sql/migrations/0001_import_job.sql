@@ -0,0 +1,20 @@
+-- Table of the Synapses imports run by the background worker.
+-- 
+-- flask db-migrate
+-- 
+
+create table if not exists import_job (
+    id serial primary key,
+    filename text,
+    created_by text,
+    status text not null default 'queued',
+    phase text,
+    sessions_read integer not null default 0,
+    new_sessions integer not null default 0,
+    modified_sessions integer not null default 0,
+    not_changed_sessions integer not null default 0,
+    deleted_sessions integer not null default 0,
+    message text,
+    created_at timestamp not null default now(),
+    updated_at timestamp not null default now()
+);
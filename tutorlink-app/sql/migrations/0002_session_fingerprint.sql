@@ -0,0 +1,7 @@
+-- Fingerprint of the Synapses content of each session, used to skip the
+-- unchanged sessions when a new export is imported.
+-- 
+-- flask db-migrate
+-- 
+
+alter table session add column if not exists fingerprint text;
@@ -0,0 +1,6 @@
+-- Index used by the session list to seek a page by (date_start, id).
+-- 
+-- flask db-migrate
+-- 
+
+create index if not exists session_date_start_id_idx on session (date_start, id);
@@ -0,0 +1,12 @@
+-- Indexes of the columns used to filter and join the sessions, and unique
+-- names for the modules and UE (the importer upserts them by name).
+-- 
+-- flask db-migrate
+-- 
+
+create index if not exists session_module_id_idx on session (module_id);
+create index if not exists session_ue_id_idx on session (ue_id);
+create index if not exists session_type_idx on session (type);
+create index if not exists lectured_by_user_username_idx on lectured_by (user_username);
+create unique index if not exists module_name_key on module (name);
+create unique index if not exists ue_name_key on ue (name);
@@ -0,0 +1,11 @@
+-- Versions of the caches shared by the workers of the application (see
+-- tutorlink/cache.py), when there is no Redis server.
+-- 
+-- flask db-migrate
+-- 
+
+create table if not exists cache_version (
+    name text primary key,
+    version bigint not null,
+    bumped_at timestamp with time zone not null default now()
+);
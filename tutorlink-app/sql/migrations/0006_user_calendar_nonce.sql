@@ -0,0 +1,7 @@
+-- Nonce signed in the address of the calendar feed of a user (see
+-- tutorlink/calendar.py): changing it revokes the previous address.
+-- 
+-- flask db-migrate
+-- 
+
+alter table "user" add column if not exists calendar_nonce text;
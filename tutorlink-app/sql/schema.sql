@@ -13,6 +13,9 @@ drop table if exists managed_by cascade;
 drop table if exists role cascade;
 drop table if exists lectured_by cascade;
 drop table if exists session_type cascade;
+drop table if exists import_job cascade;
+drop table if exists cache_version cascade;
+drop table if exists schema_migration cascade;
 
 
 create table role (
@@ -34,13 +37,14 @@ create table "user" (
   surname text,
   role_id integer,
   admin boolean default false,
+  calendar_nonce text,
   foreign key (role_id) references role(id)
 );
 
 
 create table module (
     id serial primary key,
-    name text not null,
+    name text not null unique,
     label text not null,
     description text
 );
@@ -48,7 +52,7 @@ create table module (
 
 create table ue (
     id serial primary key,
-    name text not null,
+    name text not null unique,
     label text not null
 );
 
@@ -62,11 +66,18 @@ create table session (
     ue_id integer not null,
     salle text,
     group_name text,
+    fingerprint text,
     foreign key (module_id) references module(id),
     foreign key (ue_id) references ue(id),
     foreign key (type) references session_type(id)
 );
 
+-- Sessions are listed (and paginated) by (date_start, id)
+create index session_date_start_id_idx on session (date_start, id);
+create index session_module_id_idx on session (module_id);
+create index session_ue_id_idx on session (ue_id);
+create index session_type_idx on session (type);
+
 
 create table favorite (
     user_username text not null,
@@ -86,6 +97,8 @@ create table lectured_by (
     foreign key (user_username) references "user"(username)
 );
 
+create index lectured_by_user_username_idx on lectured_by (user_username);
+
 
 create table managed_by (
     module_id integer not null,
@@ -94,3 +107,44 @@ create table managed_by (
     foreign key (module_id) references module(id),
     foreign key (user_username) references "user"(username)
 );
+
+
+create table import_job (
+    id serial primary key,
+    filename text,
+    created_by text,
+    status text not null default 'queued',
+    phase text,
+    sessions_read integer not null default 0,
+    new_sessions integer not null default 0,
+    modified_sessions integer not null default 0,
+    not_changed_sessions integer not null default 0,
+    deleted_sessions integer not null default 0,
+    message text,
+    created_at timestamp not null default now(),
+    updated_at timestamp not null default now()
+);
+
+
+-- Versions of the caches shared by the workers (see tutorlink/cache.py)
+create table cache_version (
+    name text primary key,
+    version bigint not null,
+    bumped_at timestamp with time zone not null default now()
+);
+
+
+-- Migrations of sql/migrations applied by "flask db-migrate"
+create table schema_migration (
+    name text primary key,
+    applied_at timestamp not null default now()
+);
+
+-- This schema already contains the changes of these migrations
+insert into schema_migration (name) values
+    ('0001_import_job.sql'),
+    ('0002_session_fingerprint.sql'),
+    ('0003_session_date_start_index.sql'),
+    ('0004_hot_path_indexes.sql'),
+    ('0005_cache_version.sql'),
+    ('0006_user_calendar_nonce.sql');
@@ -7,6 +7,8 @@ import warnings
 import subprocess
 from werkzeug.datastructures import FileStorage
 import json
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
 from sys import platform
 
@@ -68,7 +70,7 @@ def web_client(test_app):
 def db_objects(test_app):
     """Tous les objets pour l'accès à la base de données"""
 
-    from tutorlink.db import db_session, User, Session, Module, Ue, Role, Favorite, ManagedBy, LecturedBy, SessionType
+    from tutorlink.db import db_session, User, Session, Module, Ue, Role, Favorite, ManagedBy, LecturedBy, SessionType, ImportJob
     
     db_objects = {'db_session': db_session,
                   'User': User,
@@ -79,10 +81,24 @@ def db_objects(test_app):
                   'Favorite': Favorite,
                   'ManagedBy': ManagedBy,
                   'LecturedBy': LecturedBy,
-                  'SessionType': SessionType}
+                  'SessionType': SessionType,
+                  'ImportJob': ImportJob}
     return db_objects
 
 
+@pytest.fixture
+def sql_queries():
+    """Liste des requêtes SQL exécutées pendant le test (tous moteurs confondus)"""
+    queries = []
+
+    def record_query(conn, cursor, statement, parameters, context, executemany):
+        queries.append(statement)
+
+    event.listen(Engine, "before_cursor_execute", record_query)
+    yield queries
+    event.remove(Engine, "before_cursor_execute", record_query)
+
+
 @pytest.fixture
 def populate_file():
     """Fichier JSON de population de la base de test"""
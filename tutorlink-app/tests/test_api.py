@@ -0,0 +1,97 @@
+def test_01_sessions(web_client):
+    """Test de la liste des sessions en JSON, avec les filtres de la liste des sessions"""
+
+    # On simule la connexion CAS de l'utilisateur
+    with web_client.session_transaction() as session:
+        session['CAS_USERNAME'] = 'cleduff'
+
+    response = web_client.get('/api/sessions?date_min=2022-01-01&module=1')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/json'
+
+    sessions = response.json['sessions']
+    assert [session['id'] for session in sessions] == [1, 2]
+    assert set(sessions[0].keys()) == {'id', 'date_start', 'date_end', 'module', 'type', 'registered'}
+    assert sessions[0]['date_start'] == '2022-09-27T09:45:00'
+    assert sessions[0]['module']['id'] == 1
+    assert sessions[0]['registered'] == True
+    assert response.json['next_cursor'] is None
+
+def test_02_sparse_fields(web_client, sql_queries):
+    """Test de la sélection des champs : seules les relations nécessaires sont chargées"""
+
+    with web_client.session_transaction() as session:
+        session['CAS_USERNAME'] = 'cleduff'
+
+    sql_queries.clear()
+    response = web_client.get('/api/sessions?date_min=2022-01-01&fields=id,date_start')
+    assert response.status_code == 200
+    assert all(set(session.keys()) == {'id', 'date_start'} for session in response.json['sessions'])
+    assert not any('JOIN module' in query or 'lectured_by' in query for query in sql_queries)
+
+    response = web_client.get('/api/sessions?date_min=2022-01-01&module=1&fields=id,lecturers')
+    lecturers = response.json['sessions'][0]['lecturers']
+    assert 'cleduff' in {lecturer['username'] for lecturer in lecturers}
+    assert set(lecturers[0].keys()) == {'username', 'name', 'surname'}
+
+    response = web_client.get('/api/sessions?fields=id,password')
+    assert response.status_code == 400
+    assert response.json['errors'] == ["Unknown fields: password."]
+
+def test_03_pagination(web_client):
+    """Test de la pagination par curseur de l'API"""
+
+    with web_client.session_transaction() as session:
+        session['CAS_USERNAME'] = 'cleduff'
+
+    response = web_client.get('/api/sessions?date_min=2022-01-01&fields=id')
+    all_ids = [session['id'] for session in response.json['sessions']]
+
+    ids = []
+    url = '/api/sessions?date_min=2022-01-01&fields=id&limit=1'
+    while url:
+        response = web_client.get(url)
+        assert response.status_code == 200
+        ids += [session['id'] for session in response.json['sessions']]
+        cursor = response.json['next_cursor']
+        url = f'/api/sessions?date_min=2022-01-01&fields=id&limit=1&cursor={cursor}' if cursor else None
+    assert ids == all_ids
+
+    assert web_client.get('/api/sessions?limit=0').status_code == 400
+    assert web_client.get('/api/sessions?cursor=invalide').status_code == 400
+    assert web_client.get('/api/sessions?date_max=hier').status_code == 400
+
+def test_04_my_and_urgent_sessions(web_client):
+    """Test des sessions à venir de l'utilisateur et des sessions sans intervenant"""
+
+    with web_client.session_transaction() as session:
+        session['CAS_USERNAME'] = 'cleduff'
+
+    # Les sessions de test sont passées
+    response = web_client.get('/api/sessions/mine')
+    assert response.status_code == 200
+    assert response.json == {'sessions': [], 'next_cursor': None}
+
+    response = web_client.get('/api/sessions/urgent?fields=id,lecturers')
+    assert response.status_code == 200
+    assert all(session['lecturers'] == [] for session in response.json['sessions'])
+
+def test_05_no_login(web_client):
+    """Test d'accès à l'API sans être connecté"""
+
+    response = web_client.get('/api/sessions')
+    assert response.status_code == 302
+
+def test_06_json_without_orjson(web_client, monkeypatch):
+    """Test de la sérialisation JSON quand orjson n'est pas installé"""
+
+    from tutorlink import api
+
+    with web_client.session_transaction() as session:
+        session['CAS_USERNAME'] = 'cleduff'
+
+    response = web_client.get('/api/sessions?date_min=2022-01-01&module=1')
+    monkeypatch.setattr(api, 'orjson', None)
+    fallback = web_client.get('/api/sessions?date_min=2022-01-01&module=1')
+    assert fallback.status_code == 200
+    assert fallback.json == response.json
@@ -198,7 +198,7 @@ def test_01_login(web_client, test_app, db_objects):
         with web_client.session_transaction() as session:
             session['CAS_USERNAME'] = 'ttest2'
 
-        response = web_client.get('/hello')
+        response = web_client.get('/profile/')
 
         db_session = db_objects['db_session']
         User = db_objects['User']
@@ -213,3 +213,87 @@ def test_01_login(web_client, test_app, db_objects):
         assert g.user.username == 'ttest2'
 
     delete_user_in_db(db_objects, user=user)
+
+# Test du cache des utilisateurs connectés
+
+def test_02_user_cache(web_client, sql_queries):
+    """Test de la réutilisation de l'utilisateur en cache d'une requête à l'autre"""
+
+    from tutorlink import cache
+
+    cache.users.invalidate('amontarn')
+
+    # On simule la connexion CAS de l'utilisateur
+    with web_client.session_transaction() as session:
+        session['CAS_USERNAME'] = 'amontarn'
+
+    response = web_client.get('/profile/')
+    assert response.status_code == 200
+    assert any('FROM "user"' in query for query in sql_queries)
+
+    # La deuxième requête ne relit pas l'utilisateur
+    sql_queries.clear()
+    response = web_client.get('/profile/')
+    assert response.status_code == 200
+    assert not any('FROM "user"' in query for query in sql_queries)
+
+    snapshot = cache.users.get('amontarn')
+    assert snapshot.username == 'amontarn'
+    assert snapshot.complete
+    assert isinstance(snapshot.managed_module_ids, frozenset)
+
+def test_03_user_cache_invalidation(web_client, test_app, db_objects):
+    """Test de l'invalidation du cache lors de la modification du profil"""
+
+    from tutorlink import cache
+
+    user = create_user_in_db(db_objects, username='ttest3')
+
+    with test_app.app_context():
+        # On simule la connexion CAS de l'utilisateur
+        with web_client.session_transaction() as session:
+            session['CAS_USERNAME'] = 'ttest3'
+
+        web_client.get('/profile/')
+        assert cache.users.get('ttest3').surname == 'test'
+
+        # La modification du profil vide le cache de l'utilisateur
+        web_client.post('/profile/', data={
+                            'email': 'test.test@mail.com',
+                            'name': 'test',
+                            'surname': 'changed',
+                            'role': 2,
+                        })
+        assert cache.users.get('ttest3') is None
+
+        web_client.get('/profile/')
+        assert g.user.surname == 'changed'
+        assert g.user.role_id == 2
+
+    delete_user_in_db(db_objects, username='ttest3')
+
+def test_04_anonymous_endpoints(web_client, sql_queries):
+    """Test des routes servies sans charger l'utilisateur"""
+
+    from tutorlink import cache
+
+    cache.users.invalidate()
+
+    # Même un utilisateur non inscrit n'est pas redirigé vers l'inscription
+    with web_client.session_transaction() as session:
+        session['CAS_USERNAME'] = 'inconnu'
+
+    response = web_client.get('/static/css/tutorlink-with-bootstrap.css')
+    assert response.status_code == 200
+    response.close()
+    response = web_client.get('/hello')
+    assert response.status_code == 200
+
+    # Aucune requête SQL n'a été exécutée
+    assert sql_queries == []
+    assert len(cache.users) == 0
+
+    # Les autres routes chargent l'utilisateur
+    response = web_client.get('/profile/')
+    assert response.status_code == 302
+    assert sql_queries != []
@@ -0,0 +1,152 @@
+from tutorlink.cache import TTLCache
+
+
+class FakeTimer:
+    """Horloge contrôlée par le test"""
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_01_ttl():
+    """Test de l'expiration des entrées du cache"""
+
+    timer = FakeTimer()
+    cache = TTLCache(maxsize=10, ttl=60, timer=timer)
+    cache.set('a', 1)
+    cache.set('b', 2, ttl=120)
+    assert cache.get('a') == 1
+
+    timer.now = 60
+    assert cache.get('a') is None
+    assert cache.get('a', 'absent') == 'absent'
+    assert cache.get('b') == 2
+
+    timer.now = 120
+    assert cache.get('b') is None
+    assert len(cache) == 0
+
+
+def test_02_lru():
+    """Test de l'éviction de l'entrée la moins récemment utilisée"""
+
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    # 'a' est lue, c'est donc 'b' qui est évincée
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+
+
+def test_03_get_or_set_invalidate():
+    """Test du calcul à la demande et de l'invalidation"""
+
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return len(calls)
+
+    cache = TTLCache(maxsize=10, ttl=60)
+    assert cache.get_or_set('a', compute) == 1
+    assert cache.get_or_set('a', compute) == 1
+    assert len(calls) == 1
+
+    cache.invalidate('a')
+    assert cache.get_or_set('a', compute) == 2
+
+    cache.set('b', 0)
+    cache.invalidate()
+    assert len(cache) == 0
+
+
+class FakeRedis:
+    """Remplaçant local d'un client Redis (get / set / incr)"""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def incr(self, key):
+        self.data[key] = int(self.data.get(key, 0)) + 1
+        return self.data[key]
+
+
+def check_versioned_cache(cache):
+    """Vérifie le comportement d'un cache versionné, quel que soit son stockage"""
+
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {'value': len(calls)}
+
+    assert cache.version() == 0
+    assert cache.get_or_set('a', compute) == {'value': 1}
+    assert cache.get_or_set('a', compute) == {'value': 1}
+
+    # Changer de version invalide toutes les entrées
+    assert cache.bump() == 1
+    assert cache.version() == 1
+    assert cache.get_or_set('a', compute) == {'value': 2}
+    assert len(calls) == 2
+
+
+def test_04_versioned_cache_local():
+    """Test du cache versionné en mémoire"""
+
+    from tutorlink.cache import VersionedCache
+
+    check_versioned_cache(VersionedCache('test'))
+
+
+def test_05_versioned_cache_redis():
+    """Test du cache versionné sur un serveur compatible Redis"""
+
+    from tutorlink.cache import VersionedCache, RedisBackend, RedisCounters
+
+    client = FakeRedis()
+    check_versioned_cache(VersionedCache('test', RedisBackend(client), counters=RedisCounters(client)))
+    # Les valeurs et les versions sont partagées via le serveur
+    assert 'test:1:a' in client.data
+    assert client.data['test:version'] == 1
+
+
+def test_06_versions_not_evicted():
+    """Test de la conservation des versions quand les valeurs sont évincées"""
+
+    from tutorlink.cache import VersionedCache, LocalBackend
+
+    cache = VersionedCache('test', LocalBackend(maxsize=1))
+    cache.bump()
+    for name in 'abc':
+        cache.get_or_set(name, lambda: name)
+
+    # La version ne revient pas à 0 : les entrées des anciennes versions restent invalides
+    assert cache.version() == 1
+    assert cache.bumped_at() is not None
+
+def test_07_local_backend_ttl():
+    """Test de la durée de vie bornée des valeurs en mémoire"""
+
+    from tutorlink.cache import LocalBackend
+
+    backend = LocalBackend(ttl=300)
+    timer = FakeTimer()
+    backend._entries.timer = timer
+    backend.set('a', 1)
+    timer.now = 299
+    assert backend.get('a') == 1
+    timer.now = 300
+    assert backend.get('a') is None
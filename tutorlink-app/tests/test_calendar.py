@@ -0,0 +1,132 @@
+def test_01_content_line(test_app):
+    """Test de l'échappement et du pliage des lignes iCalendar"""
+
+    from tutorlink.calendar import content_line, escape_text
+
+    assert escape_text('Salle 1, bâtiment A; étage\n2') == 'Salle 1\\, bâtiment A\\; étage\\n2'
+    assert content_line('SUMMARY', 'Cours') == 'SUMMARY:Cours\r\n'
+
+    # Les lignes de plus de 75 octets sont pliées, sans couper un caractère UTF-8
+    line = content_line('DESCRIPTION', 'é' * 100)
+    folded = line[:-2].split('\r\n ')
+    assert len(folded) > 1
+    assert all(len(part.encode('utf-8')) <= 75 - (i > 0) for i, part in enumerate(folded))
+    assert ''.join(folded) == 'DESCRIPTION:' + 'é' * 100
+
+def test_02_feed(web_client, test_app, sql_queries):
+    """Test du flux iCalendar d'un intervenant et de ses requêtes conditionnelles"""
+
+    from tutorlink.calendar import feed_token
+
+    with test_app.test_request_context():
+        url = f"/calendar/{feed_token('afertier')}.ics"
+
+    # Le flux n'a pas besoin de connexion CAS : il est authentifié par son jeton
+    response = web_client.get(url)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/calendar'
+    body = response.data.decode('utf-8')
+    assert body.startswith('BEGIN:VCALENDAR\r\n')
+    assert body.endswith('END:VCALENDAR\r\n')
+    assert 'UID:session-1@tutorlink\r\n' in body
+    assert 'DTSTART:20220927T094500\r\n' in body
+    assert 'UID:session-3@tutorlink' not in body
+
+    # Un flux inchangé ne coûte que la lecture du nonce et de la version
+    sql_queries.clear()
+    response = web_client.get(url, headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
+    assert len(sql_queries) == 2
+    assert 'calendar_nonce' in sql_queries[0]
+    assert 'from cache_version' in sql_queries[1]
+
+    # Sans ETag, le flux est servi depuis le cache
+    sql_queries.clear()
+    response = web_client.get(url)
+    assert response.status_code == 200
+    assert response.data.decode('utf-8') == body
+    assert not any('FROM session' in query for query in sql_queries)
+
+    response = web_client.get('/calendar/afertier.ics')
+    assert response.status_code == 404
+
+def test_03_feed_invalidation(web_client, test_app):
+    """Test de l'invalidation du flux par les inscriptions de l'intervenant"""
+
+    from tutorlink import cache
+    from tutorlink.calendar import feed_token
+
+    with test_app.test_request_context():
+        url = f"/calendar/{feed_token('mmirza')}.ics"
+
+    response = web_client.get(url)
+    etag = response.headers['ETag']
+    assert 'UID:session-3@tutorlink' not in response.data.decode('utf-8')
+
+    # Une inscription d'un autre utilisateur ne change pas le flux
+    cache.calendars.bump('benaben')
+    assert web_client.get(url, headers={'If-None-Match': etag}).status_code == 304
+
+    with web_client.session_transaction() as session:
+        session['CAS_USERNAME'] = 'mmirza'
+    web_client.post('/session/register', data=dict(session_id=3))
+
+    response = web_client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert 'UID:session-3@tutorlink' in response.data.decode('utf-8')
+
+    web_client.post('/session/unregister', data=dict(session_id=3))
+    response = web_client.get(url)
+    assert 'UID:session-3@tutorlink' not in response.data.decode('utf-8')
+
+def test_04_profile_calendar_url(web_client):
+    """Test de l'affichage de l'adresse du flux sur le profil"""
+
+    with web_client.session_transaction() as session:
+        session['CAS_USERNAME'] = 'cleduff'
+
+    response = web_client.get('/profile/')
+    assert response.status_code == 200
+    assert '/calendar/' in response.data.decode('utf-8')
+
+def test_05_feed_reset(web_client, test_app, db_objects):
+    """Test de la révocation de l'adresse du flux par un nouveau nonce"""
+
+    from itsdangerous import URLSafeSerializer
+    from tutorlink.calendar import feed_token
+
+    db_session = db_objects['db_session']
+    User = db_objects['User']
+
+    with test_app.test_request_context():
+        old_url = f"/calendar/{feed_token('gslaoui')}.ics"
+        # Les adresses signées avant les nonces restent valides jusqu'au premier changement
+        legacy_token = URLSafeSerializer(test_app.secret_key, salt='calendar-feed').dumps('gslaoui')
+        legacy_url = f"/calendar/{legacy_token}.ics"
+    assert web_client.get(old_url).status_code == 200
+    assert web_client.get(legacy_url).status_code == 200
+
+    with web_client.session_transaction() as session:
+        session['CAS_USERNAME'] = 'gslaoui'
+    response = web_client.post('/profile/calendar/reset', follow_redirects=True)
+    assert response.status_code == 200
+    assert 'Calendar address reset' in response.data.decode('utf-8')
+
+    # Les anciennes adresses ne fonctionnent plus, même pour une requête conditionnelle
+    assert web_client.get(old_url).status_code == 404
+    assert web_client.get(legacy_url).status_code == 404
+    assert web_client.get(old_url, headers={'If-None-Match': '*'}).status_code == 404
+
+    # La nouvelle adresse est celle affichée sur le profil
+    db_session.expire_all()
+    nonce = db_session.get(User, 'gslaoui').calendar_nonce
+    assert nonce
+    with test_app.test_request_context():
+        new_url = f"/calendar/{feed_token('gslaoui', nonce)}.ics"
+    assert new_url in web_client.get('/profile/').data.decode('utf-8')
+    assert web_client.get(new_url).status_code == 200
+
+    # Un jeton signé mais mal formé est refusé
+    with test_app.test_request_context():
+        bad_token = URLSafeSerializer(test_app.secret_key, salt='calendar-feed').dumps(['gslaoui'])
+    assert web_client.get(f"/calendar/{bad_token}.ics").status_code == 404
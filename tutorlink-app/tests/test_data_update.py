@@ -1,6 +1,11 @@
 import pandas as pd
+import pytest
+import time
+import warnings
+from random import Random
 from werkzeug.datastructures import FileStorage
 import io
+import os
 import json
 from flask import get_flashed_messages, url_for
 from sqlalchemy import select
@@ -39,9 +44,24 @@ def test_03_data_update_route_no_login(web_client):
     assert response.request.path == url_for('auth.login')
 
 
-def test_04_parse_users():
+def parse_users(row):
+    """Lecture ligne à ligne d'un intervenant (ancienne version, référence des tests)"""
+
+    from tutorlink.data import USER_NAME_PATTERN
+
+    if row is None:
+        return pd.Series([None, None, None])
+    else:
+        name, username = next(iter(row.items()))
+        try:
+            # Parse firstname and surname
+            surname, firstname = USER_NAME_PATTERN.search(name).groups()
+        except AttributeError:
+            surname, firstname = name, ''
 
-    from tutorlink.data import parse_users
+        return pd.Series([surname, firstname, username])
+
+def test_04_parse_users():
 
     assert parse_users(None).equals(pd.Series([None, None, None]))
 
@@ -50,6 +70,21 @@ def test_04_parse_users():
 
     assert (pd.Series([{"FERTIER AUDREY":"afertier"}]).apply(parse_users).values == pd.Series(['FERTIER AUDREY', '', 'afertier']).values).all()
 
+def test_04_normalize_users(populate_dict):
+    """Test de la lecture des noms et prénoms des intervenants par normalize_sessions"""
+
+    from tutorlink.data import normalize_sessions
+
+    session = populate_dict[0]
+    session['intervenants'] = [{"FERTIER Audrey": "afertier"},
+                               {"FERTIER TEST Audrey": "atest"},
+                               {"FERTIER AUDREY": "aupper"}]
+    _, _, _, _, users = normalize_sessions(pd.DataFrame.from_records([session]))
+
+    assert users.values.tolist() == [['FERTIER', 'Audrey', 'afertier'],
+                                     ['FERTIER TEST', 'Audrey', 'atest'],
+                                     ['FERTIER AUDREY', '', 'aupper']]
+
 def test_05_read_json():
     """Test de la lecture du fichier JSON"""
 
@@ -110,6 +145,95 @@ def test_05_read_json():
     assert ["FERTIER", "Audrey", "afertier",] in users.values
     assert ["BENABEN", "Frederick", "benaben"] in users.values
 
+def test_05_iter_json_array(populate_dict):
+    """Test de la lecture incrémentale du fichier JSON"""
+
+    from tutorlink.data import iter_json_array
+
+    # Des morceaux très petits obligent à reprendre le décodage au milieu des éléments
+    with open('tests/populate.json', 'rb') as f:
+        assert list(iter_json_array(f, chunk_size=7)) == populate_dict
+
+    assert list(iter_json_array(io.BytesIO(b' [ ] '))) == []
+
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.BytesIO(b'{"id": 1}')))
+
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.BytesIO(b'[{"id": 1}, {"id"')))
+
+    # Une seule virgule entre deux éléments, et rien d'autre que des blancs après le tableau
+    assert list(iter_json_array(io.BytesIO(b'[1, 2]\n'), chunk_size=1)) == [1, 2]
+    for content in (b'[1 2]', b'[1,,,2]', b'[,1]', b'[1,]', b'[1, 2] garbage', b'[1, 2]]', b'[1, 2'):
+        with pytest.raises(ValueError):
+            list(iter_json_array(io.BytesIO(content), chunk_size=2))
+
+def test_05_read_json_batches():
+    """Test de la lecture du fichier JSON par lots de sessions"""
+
+    from tutorlink.data import read_json_batches
+
+    batches = list(read_json_batches('tests/populate.json', batch_size=2))
+
+    assert [len(sessions) for sessions, _, _, _, _ in batches] == [2, 1]
+    assert [1, 2, 3] == [id for sessions, _, _, _, _ in batches for id in sessions['id']]
+
+def row_wise_normalize(df):
+    """Normalisation ligne à ligne des sessions (ancienne version de read_json)"""
+
+    df['date_start'] = pd.to_datetime(df['date'] + ' ' + df['heuredeb'])
+    df['date_end'] = pd.to_datetime(df['date'] + ' ' + df['heurefin'])
+
+    session_types = df[['type_synapses', 'libelle']].drop_duplicates()
+    session_types = {row['type_synapses']: row['libelle'] for _, row in session_types.iterrows()}
+
+    modules = df[['module', 'intitule_module']].drop_duplicates()
+    modules = {row['module']: row['intitule_module'] for _, row in modules.iterrows()}
+
+    ue = df[['ue', 'intitule_ue']].drop_duplicates()
+    ue = {row['ue']: row['intitule_ue'] for _, row in ue.iterrows()}
+
+    users = df['intervenants'].explode().drop_duplicates().dropna()
+    users = users.apply(parse_users).rename(columns={0: 'surname', 1: 'firstname', 2: 'username'})
+    users.reset_index(drop=True, inplace=True)
+
+    df['intervenants'] = df['intervenants'].fillna('').apply(list)
+    df['intervenants'] = df['intervenants'].apply(lambda row: [next(iter(user.values())) for user in row])
+
+    df['salles'] = df['salles'].apply(lambda row: ', '.join(row))
+
+    return df, session_types, modules, ue, users
+
+def test_05_normalize_sessions_benchmark(populate_dict):
+    """Test de performance de la normalisation vectorisée sur 50 000 sessions"""
+
+    from tutorlink.data import normalize_sessions
+
+    random = Random(0)
+    records = []
+    for id in range(50000):
+        record = dict(random.choice(populate_dict), id=id)
+        record['module'] = f"MOD-{id % 300}"
+        record['intervenants'] = [{f"NOM{n} COMPOSE Prénom{n}": f"user{n}"}
+                                  for n in random.sample(range(500), random.randint(0, 3))]
+        records.append(record)
+
+    start = time.perf_counter()
+    expected = row_wise_normalize(pd.DataFrame.from_records(records))
+    row_wise_duration = time.perf_counter() - start
+
+    start = time.perf_counter()
+    sessions, session_types, modules, ue, users = normalize_sessions(pd.DataFrame.from_records(records))
+    vectorized_duration = time.perf_counter() - start
+
+    assert sessions['intervenants'].tolist() == expected[0]['intervenants'].tolist()
+    assert sessions['salles'].tolist() == expected[0]['salles'].tolist()
+    assert (session_types, modules, ue) == expected[1:4]
+    assert sorted(map(tuple, users.values.tolist())) == sorted(map(tuple, expected[4].values.tolist()))
+
+    warnings.warn(f"\nnormalize_sessions: {row_wise_duration:.3f}s (row-wise) => {vectorized_duration:.3f}s (vectorized)")
+    assert vectorized_duration < row_wise_duration
+
 def test_06_data_update_no_file(web_client):
     """Test de la mise à jour des données sans fichier"""
 
@@ -450,3 +574,269 @@ def test_12_data_update_delete_session(web_client, populate_file):
             and '1 deleted sessions' in message):
             cond = True
     assert cond
+
+def test_13_populate_db_several_batches(test_app, populate_dict):
+    """Test de l'import d'un fichier plus grand qu'un lot d'insertion"""
+
+    from tutorlink.data import read_json, populate_db, BATCH_SIZE
+
+    nb_sessions = BATCH_SIZE * 2 + 1
+    synthetic = [dict(populate_dict[0], id=1000 + i) for i in range(nb_sessions)]
+
+    with test_app.app_context():
+        input_json = io.BytesIO(json.dumps(populate_dict + synthetic).encode("utf-8"))
+        result = populate_db(*read_json(input_json))
+        assert result == [f'{nb_sessions} new sessions',
+                          '0 modified sessions',
+                          '3 not changed sessions',
+                          '0 deleted sessions']
+
+        # On revient à l'état initial de la base
+        input_json = io.BytesIO(json.dumps(populate_dict).encode("utf-8"))
+        result = populate_db(*read_json(input_json))
+        assert result == ['0 new sessions',
+                          '0 modified sessions',
+                          '3 not changed sessions',
+                          f'{nb_sessions} deleted sessions']
+
+def test_14_data_update_job_status(web_client, populate_file, db_objects):
+    """Test du suivi d'un import via son job"""
+
+    # On simule la connexion CAS de l'utilisateur
+    with web_client.session_transaction() as session:
+        session['CAS_USERNAME'] = 'amontarn'
+
+    response = web_client.post('/data/update',
+                               data=dict(file=populate_file))
+    assert response.status_code == 200
+
+    db_session = db_objects['db_session']
+    ImportJob = db_objects['ImportJob']
+    job = db_session.execute(
+                select(ImportJob)
+                .order_by(ImportJob.id.desc())
+            ).scalars().first()
+
+    response = web_client.get(f'/data/jobs/{job.id}')
+    assert response.status_code == 200
+
+    status = response.get_json()
+    assert status['id'] == job.id
+    assert status['filename'] == 'populate.json'
+    assert status['created_by'] == 'amontarn'
+    assert status['status'] == 'done'
+    assert status['sessions_read'] == 3
+    assert status['not_changed_sessions'] == 3
+    assert '3 not changed sessions' in status['message']
+
+def test_15_data_update_job_status_errors(web_client):
+    """Test du suivi d'un job inexistant ou sans être admin"""
+
+    # On simule la connexion CAS de l'utilisateur
+    with web_client.session_transaction() as session:
+        session['CAS_USERNAME'] = 'amontarn'
+
+    response = web_client.get('/data/jobs/999999')
+    assert response.status_code == 404
+
+    # On simule la connexion CAS de l'utilisateur non admin
+    with web_client.session_transaction() as session:
+        session['CAS_USERNAME'] = 'benaben'
+
+    response = web_client.get('/data/jobs/1')
+    assert response.status_code == 403
+
+def test_16_data_update_background(web_client, test_app, populate_file):
+    """Test d'un import exécuté en arrière-plan"""
+
+    test_app.config['DATA_IMPORT_ASYNC'] = True
+
+    # On simule la connexion CAS de l'utilisateur
+    with web_client.session_transaction() as session:
+        session['CAS_USERNAME'] = 'amontarn'
+
+    response = web_client.post('/data/update',
+                               data=dict(file=populate_file))
+    assert response.status_code == 200
+
+    messages = get_flashed_messages(with_categories=True)
+    assert ('info', 'Import of populate.json queued.') in messages
+
+    # On attend la fin de l'import
+    test_app.extensions['import_executor'].shutdown(wait=True)
+
+    response = web_client.get('/data/update')
+    assert response.status_code == 200
+    assert 'Status: <span id="job_status">done</span>' in response.data.decode('utf-8')
+
+def test_17_data_update_fingerprint(web_client, test_app, db_objects, populate_dict):
+    """Test du saut des sessions dont l'empreinte n'a pas changé"""
+
+    from tutorlink.data import populate_db, read_json
+
+    db_session = db_objects['db_session']
+    Session = db_objects['Session']
+
+    with test_app.app_context():
+        populate_db(*read_json('tests/populate.json'))
+
+        session = db_session.get(Session, 1)
+        assert session.fingerprint is not None
+
+        # Une modification faite directement en base n'est pas vue tant que l'empreinte est la même
+        session.group_name = 'Groupe modifié à la main'
+        db_session.commit()
+
+        result = populate_db(*read_json('tests/populate.json'))
+        assert '3 not changed sessions' in result
+        assert db_session.get(Session, 1).group_name == 'Groupe modifié à la main'
+
+        # Sans empreinte, la session est comparée colonne par colonne
+        db_session.get(Session, 1).fingerprint = None
+        db_session.commit()
+
+        result = populate_db(*read_json('tests/populate.json'))
+        assert '1 modified sessions' in result
+        assert db_session.get(Session, 1).group_name == populate_dict[0]['groupes']
+
+    # La désinscription d'un intervenant Synapses efface l'empreinte de la session
+    with web_client.session_transaction() as session:
+        session['CAS_USERNAME'] = 'afertier'
+
+    web_client.post('/session/unregister', data=dict(session_id=1))
+
+    db_session.expire_all()
+    assert db_session.get(Session, 1).fingerprint is None
+
+    with test_app.app_context():
+        result = populate_db(*read_json('tests/populate.json'))
+        assert '1 modified sessions' in result
+
+def test_18_data_update_reference_cache(test_app, db_objects):
+    """Test de l'invalidation des caches par un import, selon les données modifiées"""
+
+    from tutorlink import cache
+    from tutorlink.data import populate_db, read_json
+
+    db_session = db_objects['db_session']
+    Session = db_objects['Session']
+
+    def versions():
+        return (cache.reference_data.version(), cache.session_cards.version(),
+                cache.data.version(), cache.calendars.version('afertier'))
+
+    with test_app.app_context():
+        populate_db(*read_json('tests/populate.json'))
+
+        # Un import sans changement n'invalide aucun cache
+        before = versions()
+        populate_db(*read_json('tests/populate.json'))
+        assert versions() == before
+
+        # Un libellé de module rétabli par l'import invalide les données de
+        # référence, les cartes, les pages et les calendriers
+        module = db_session.get(Session, 1).module
+        label = module.label
+        module.label = label + ' (ancien)'
+        db_session.commit()
+        populate_db(*read_json('tests/populate.json'))
+        assert versions() == tuple(version + 1 for version in before)
+        db_session.expire_all()
+        assert db_session.get(Session, 1).module.label == label
+
+def test_19_data_update_calendar_cache(test_app, db_objects):
+    """Test de l'invalidation des calendriers des seuls intervenants des sessions importées"""
+
+    from sqlalchemy import select
+    from tutorlink import cache
+    from tutorlink.data import populate_db, read_json
+
+    db_session = db_objects['db_session']
+    Session = db_objects['Session']
+    LecturedBy = db_objects['LecturedBy']
+    usernames = ('afertier', 'cleduff', 'benaben', 'amontarn', 'mmirza', 'gslaoui')
+
+    with test_app.app_context():
+        populate_db(*read_json('tests/populate.json'))
+        versions = {username: cache.calendars.version(username) for username in usernames}
+
+        # Sans changement, aucun calendrier n'est invalidé
+        populate_db(*read_json('tests/populate.json'))
+        assert {username: cache.calendars.version(username) for username in usernames} == versions
+
+        # La session 1 est comparée à nouveau : seuls ses intervenants sont concernés
+        lecturers = set(db_session.execute(
+            select(LecturedBy.user_username)
+            .where(LecturedBy.session_id == 1)).scalars())
+        assert {'afertier', 'cleduff'} <= lecturers
+
+        db_session.get(Session, 1).fingerprint = None
+        db_session.commit()
+        populate_db(*read_json('tests/populate.json'))
+        for username in usernames:
+            bumped = 1 if username in lecturers else 0
+            assert cache.calendars.version(username) == versions[username] + bumped
+
+def test_20_data_update_import_lock(test_app, db_objects):
+    """Test du verrou qui empêche deux imports simultanés"""
+
+    from sqlalchemy import func
+    from tutorlink import db, jobs
+    from tutorlink.data import SynapsesImporter
+
+    db_session = db_objects['db_session']
+
+    def lock_is_free():
+        with db.engine.begin() as connection:
+            return connection.execute(select(func.pg_try_advisory_xact_lock(jobs.IMPORT_LOCK_KEY))).scalar()
+
+    with test_app.app_context():
+        # Un import garde le verrou jusqu'à la fin de sa transaction
+        SynapsesImporter()
+        assert not lock_is_free()
+        db_session.rollback()
+        assert lock_is_free()
+
+def test_21_data_update_stale_jobs(test_app, db_objects):
+    """Test de l'échec des imports interrompus par un redémarrage"""
+
+    import datetime
+    from sqlalchemy import func
+    from tutorlink import db, jobs
+
+    db_session = db_objects['db_session']
+    ImportJob = db_objects['ImportJob']
+
+    old = datetime.datetime.now() - datetime.timedelta(hours=1)
+    stale = ImportJob(filename='stale.json', status='running', updated_at=old)
+    recent = ImportJob(filename='recent.json', status='queued')
+    db_session.add_all([stale, recent])
+    db_session.commit()
+    for job in (stale, recent):
+        with open(jobs.job_path(job.id), 'w') as f:
+            f.write('[]')
+
+    try:
+        # Pendant un import, aucun job n'est considéré comme interrompu
+        with db.engine.begin() as connection:
+            connection.execute(select(func.pg_advisory_xact_lock(jobs.IMPORT_LOCK_KEY)))
+            assert jobs.fail_stale_jobs(600) == []
+
+        # Le démarrage de l'application marque le job interrompu en échec et supprime son fichier
+        from tutorlink import create_app
+        create_app({'TESTING': True})
+
+        db_session.expire_all()
+        assert db_session.get(ImportJob, stale.id).status == 'failed'
+        assert 'interrupted' in db_session.get(ImportJob, stale.id).message
+        assert not os.path.exists(jobs.job_path(stale.id))
+        # Un job mis en attente à l'instant par un autre worker est laissé tel quel
+        assert db_session.get(ImportJob, recent.id).status == 'queued'
+        assert os.path.exists(jobs.job_path(recent.id))
+    finally:
+        for job in (stale, recent):
+            if os.path.exists(jobs.job_path(job.id)):
+                os.remove(jobs.job_path(job.id))
+        db_session.delete(db_session.get(ImportJob, stale.id))
+        db_session.delete(db_session.get(ImportJob, recent.id))
+        db_session.commit()
@@ -1,5 +1,7 @@
 from sqlalchemy import select
 
+from tutorlink import cache
+
 # Test d'utilisation de la base de données
 def create_user_in_db(db_objects, username="ttest", no_data=False):
     """Création d'un utilisateur dans la base de données"""
@@ -24,6 +26,8 @@ def create_user_in_db(db_objects, username="ttest", no_data=False):
     db_session.add(user)
     # on le créer réellement (on peut récuper son id automatique)
     db_session.commit()
+    # l'utilisateur est modifié sans passer par l'application : on vide son cache
+    cache.users.invalidate(username)
 
     return user
 
@@ -39,6 +43,7 @@ def delete_user_in_db(db_objects, username="ttest", user=None):
         # on efface l'utilisateur
         db_session.delete(user)
         db_session.commit()
+        cache.users.invalidate(user.username)
 
 def test_01_consultation(db_objects):
     """Test d'accès à la base de données"""
@@ -78,3 +83,192 @@ def test_02_create_and_delete_user(db_objects):
     # on vérifie qu'il n'existe plus dans la base
     db_user = db_session.execute(select(User).where(User.username == username)).scalars().first()
     assert db_user is None
+
+def test_03_db_migrate(test_app, tmp_path):
+    """Test de la commande d'application des migrations"""
+
+    from tutorlink import db
+    from sqlalchemy import text
+
+    runner = test_app.test_cli_runner()
+
+    # Une base créée avec sql/schema.sql contient déjà toutes les migrations
+    result = runner.invoke(args=['db-migrate'])
+    assert result.exit_code == 0
+    assert 'The database is up to date.' in result.output
+
+    # Une nouvelle migration est détectée, puis appliquée
+    (tmp_path / '0001_first.sql').write_text("create table if not exists migration_test (id integer);")
+    (tmp_path / '0002_second.sql').write_text("insert into migration_test values (1);")
+    (tmp_path / 'readme.txt').write_text("pas une migration")
+    test_app.config['MIGRATIONS_DIR'] = str(tmp_path)
+
+    result = runner.invoke(args=['db-migrate', '--dry-run'])
+    assert result.output.splitlines() == ['pending: 0001_first.sql', 'pending: 0002_second.sql']
+
+    try:
+        assert db.apply_migrations(db.engine, str(tmp_path)) == ['0001_first.sql', '0002_second.sql']
+        assert db.apply_migrations(db.engine, str(tmp_path)) == []
+        with db.engine.begin() as connection:
+            assert connection.execute(text("select count(*) from migration_test")).scalar() == 1
+    finally:
+        with db.engine.begin() as connection:
+            connection.execute(text("drop table if exists migration_test"))
+            connection.execute(text("delete from schema_migration where name in ('0001_first.sql', '0002_second.sql')"))
+
+def test_04_schema_key(test_app):
+    """Test de la clé des métadonnées en cache, qui suit les migrations appliquées"""
+
+    from sqlalchemy import text
+    from tutorlink import db
+
+    key = db.schema_key(test_app, db.engine)
+
+    # Une nouvelle migration appliquée change la clé
+    with db.engine.begin() as connection:
+        connection.execute(text("insert into schema_migration (name) values ('9999_test.sql')"))
+    try:
+        new_key = db.schema_key(test_app, db.engine)
+        assert new_key is not None
+        assert new_key != key
+    finally:
+        with db.engine.begin() as connection:
+            connection.execute(text("delete from schema_migration where name = '9999_test.sql'"))
+
+def test_05_load_metadata(test_app, tmp_path):
+    """Test de la mise en cache des métadonnées réfléchies"""
+
+    from tutorlink import db
+
+    test_app.instance_path = str(tmp_path)
+
+    metadata = db.load_metadata(test_app, db.engine, 'test')
+    assert (tmp_path / 'metadata-test.pickle').exists()
+    assert set(metadata.tables) == set(db.MODEL_MAP)
+
+    # La deuxième fois, la base n'est pas interrogée
+    cached = db.load_metadata(test_app, None, 'test')
+    assert set(cached.tables) == set(metadata.tables)
+    assert [c.name for c in cached.tables['session'].columns] == [c.name for c in metadata.tables['session'].columns]
+
+def test_06_routing_session(test_app, db_objects):
+    """Test du choix de la base (primaire ou réplique) selon la requête"""
+
+    from flask import g
+    from sqlalchemy import create_engine, event
+    from tutorlink.db import RoutingSession
+
+    from .conftest import SQLALCHEMY_DATABASE_URI_TEST
+
+    # Deux moteurs distincts sur la même base suffisent à suivre le routage
+    primary = create_engine(SQLALCHEMY_DATABASE_URI_TEST)
+    replica = create_engine(SQLALCHEMY_DATABASE_URI_TEST)
+    executed = []
+    event.listen(primary, 'before_cursor_execute', lambda *args: executed.append('primary'))
+    event.listen(replica, 'before_cursor_execute', lambda *args: executed.append('replica'))
+
+    Role = db_objects['Role']
+    role_table = Role.__table__
+
+    try:
+        with test_app.test_request_context():
+            with RoutingSession(info={'primary': primary, 'replica': replica}) as session:
+                # Hors d'une vue @read_only, tout va au primaire
+                session.execute(select(Role))
+                assert executed == ['primary']
+
+                # Dans une vue @read_only, les lectures vont à la réplique...
+                g.db_read_only = True
+                session.execute(select(Role))
+                assert executed[-1] == 'replica'
+
+                # ... mais les écritures restent sur le primaire
+                session.execute(role_table.update().where(role_table.c.id == -1).values(name='x'))
+                assert executed[-1] == 'primary'
+                assert g.db_wrote == True
+                session.rollback()
+    finally:
+        primary.dispose()
+        replica.dispose()
+
+def test_07_read_your_writes(web_client, test_app, db_objects):
+    """Test de la lecture sur le primaire après une écriture de l'utilisateur"""
+
+    import time
+    from flask import g
+    from tutorlink.db import PRIMARY_UNTIL_KEY
+
+    create_user_in_db(db_objects, username='ttest4')
+
+    with test_app.app_context():
+        with web_client.session_transaction() as session:
+            session['CAS_USERNAME'] = 'ttest4'
+
+        # Sans écriture récente, la liste des sessions est lue sur la réplique
+        web_client.get('/session/list')
+        assert g.db_read_only == True
+
+        # Après la modification de son profil, l'utilisateur lit sur le primaire
+        web_client.post('/profile/', data={
+                            'email': 'test.test@mail.com',
+                            'name': 'test',
+                            'surname': 'test',
+                            'role': 2,
+                        })
+        with web_client.session_transaction() as session:
+            assert session[PRIMARY_UNTIL_KEY] > time.time()
+
+        web_client.get('/session/list')
+        assert g.db_read_only == False
+
+        # Une fois le délai écoulé, il revient sur la réplique
+        with web_client.session_transaction() as session:
+            session[PRIMARY_UNTIL_KEY] = time.time() - 1
+
+        web_client.get('/session/list')
+        assert g.db_read_only == True
+
+    delete_user_in_db(db_objects, username='ttest4')
+
+def test_08_db_migrate_baseline():
+    """Test de la mise à jour d'une base créée avant les migrations"""
+
+    from sqlalchemy import create_engine, text
+    from tutorlink import create_app, db
+
+    from .conftest import SQLALCHEMY_DATABASE_URI_TEST, execute_sql_file_with_psql
+
+    # La base de la première version est créée dans un schéma PostgreSQL à part
+    url = SQLALCHEMY_DATABASE_URI_TEST + "?options=-csearch_path%3Dbaseline"
+    engine = create_engine(SQLALCHEMY_DATABASE_URI_TEST)
+    with engine.begin() as connection:
+        connection.execute(text("drop schema if exists baseline cascade"))
+        connection.execute(text("create schema baseline"))
+
+    try:
+        execute_sql_file_with_psql(url, "tests/baseline_schema.sql")
+
+        # L'application démarre sans les tables ajoutées par les migrations
+        app = create_app({'SQLALCHEMY_DATABASE_URI': url})
+        assert db.ImportJob is None
+        assert 'fingerprint' not in db.Session.__table__.c
+
+        result = app.test_cli_runner().invoke(args=['db-migrate'])
+        assert result.exit_code == 0, result.output
+        assert result.output.splitlines() == ['applied: 0001_import_job.sql',
+                                              'applied: 0002_session_fingerprint.sql',
+                                              'applied: 0003_session_date_start_index.sql',
+                                              'applied: 0004_hot_path_indexes.sql',
+                                              'applied: 0005_cache_version.sql',
+                                              'applied: 0006_user_calendar_nonce.sql']
+
+        # Une fois migrée, la base est vue avec ses nouvelles tables et colonnes
+        create_app({'SQLALCHEMY_DATABASE_URI': url})
+        assert db.ImportJob is not None
+        assert 'fingerprint' in db.Session.__table__.c
+        db.engine.dispose()
+        app.extensions['pool_metrics'].engine.dispose()
+    finally:
+        with engine.begin() as connection:
+            connection.execute(text("drop schema if exists baseline cascade"))
+        engine.dispose()
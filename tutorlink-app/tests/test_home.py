@@ -50,3 +50,60 @@ def test_04_enseignant(web_client):
     assert response.status_code == 200
 
     assert bytes("/∞", 'utf-8') in response.data
+
+def test_05_query_count(web_client, sql_queries):
+    """Test du nombre de requêtes SQL pour afficher la page d'accueil"""
+
+    # On simule la connexion CAS de l'utilisateur
+    with web_client.session_transaction() as session:
+        session['CAS_USERNAME'] = 'amontarn'
+
+    response = web_client.get('/')
+    assert response.status_code == 200
+
+    # Les modules, UE, types et intervenants des cartes sont chargés avec les sessions
+    assert len(sql_queries) <= 7
+
+def test_06_total_duration(web_client):
+    """Test du total des heures assurées par l'utilisateur"""
+
+    # On simule la connexion CAS de l'utilisateur
+    with web_client.session_transaction() as session:
+        session['CAS_USERNAME'] = 'cleduff'
+
+    # Les sessions 1 et 2 durent chacune 1h30
+    response = web_client.get('/')
+    assert response.status_code == 200
+    assert b"progressEndValue = 3.0/64*100" in response.data
+
+    # Un utilisateur sans session a un total nul
+    with web_client.session_transaction() as session:
+        session['CAS_USERNAME'] = 'amontarn'
+
+    response = web_client.get('/')
+    assert response.status_code == 200
+    assert bytes("0.0/∞", 'utf-8') in response.data
+
+def test_07_open_sessions(web_client):
+    """Test du compteur (mis en cache) des sessions sans intervenant"""
+
+    from tutorlink import cache
+
+    # On simule la connexion CAS de l'utilisateur
+    with web_client.session_transaction() as session:
+        session['CAS_USERNAME'] = 'amontarn'
+
+    # Toutes les sessions de test sont passées
+    cache.open_sessions.invalidate()
+    response = web_client.get('/')
+    assert response.status_code == 200
+    assert b'id="open_sessions">0</span>' in response.data
+
+    # La valeur en cache est réutilisée jusqu'à son invalidation
+    cache.open_sessions.set('count', 42)
+    response = web_client.get('/')
+    assert b'id="open_sessions">42</span>' in response.data
+
+    cache.open_sessions.invalidate()
+    response = web_client.get('/')
+    assert b'id="open_sessions">0</span>' in response.data
@@ -0,0 +1,78 @@
+import pytest
+from sqlalchemy import create_engine, exc, text
+
+from tutorlink import metrics
+from tutorlink.db import pool_options
+
+from .conftest import SQLALCHEMY_DATABASE_URI_TEST
+
+
+def test_01_pool_options():
+    """Test des options du pool de connexions issues de la configuration"""
+
+    options = pool_options({'SQLALCHEMY_POOL_SIZE': 2,
+                            'SQLALCHEMY_MAX_OVERFLOW': 0,
+                            'SQLALCHEMY_POOL_PRE_PING': True})
+    assert options['poolclass'] is metrics.TimedQueuePool
+    assert options['pool_size'] == 2
+    assert options['max_overflow'] == 0
+    assert options['pool_pre_ping'] == True
+
+    # Derrière PgBouncer, aucune connexion n'est conservée
+    assert pool_options({'SQLALCHEMY_NULL_POOL': True}) == {'poolclass': metrics.TimedNullPool}
+
+
+def test_02_pool_metrics():
+    """Test des compteurs du pool de connexions"""
+
+    engine = create_engine(SQLALCHEMY_DATABASE_URI_TEST,
+                           **pool_options({'SQLALCHEMY_POOL_SIZE': 1,
+                                           'SQLALCHEMY_MAX_OVERFLOW': 0,
+                                           'SQLALCHEMY_POOL_TIMEOUT': 0.1}))
+    pool_metrics = metrics.instrument_engine(engine)
+
+    try:
+        with engine.connect() as connection:
+            connection.execute(text("select 1"))
+
+            # Le pool est épuisé : la deuxième connexion attend puis échoue
+            with pytest.raises(exc.TimeoutError):
+                engine.connect()
+
+            result = pool_metrics.to_dict()
+            assert result['checked_out'] == 1
+
+        with engine.connect() as connection:
+            connection.execute(text("select 1"))
+
+        result = pool_metrics.to_dict()
+        assert result['pool'] == 'TimedQueuePool'
+        assert result['checkouts'] == 2
+        assert result['timeouts'] == 1
+        assert result['connects'] == 1
+        assert result['checked_out'] == 0
+        assert result['wait_max'] >= 0.1
+
+        # Les compteurs sont conservés quand le pool est recréé
+        engine.dispose()
+        with engine.connect() as connection:
+            connection.execute(text("select 1"))
+        assert pool_metrics.to_dict()['checkouts'] == 3
+    finally:
+        engine.dispose()
+
+
+def test_03_pool_route(web_client, test_app, sql_queries):
+    """Test de la route de supervision du pool"""
+
+    # Par défaut, la route n'existe pas
+    response = web_client.get('/metrics/pool')
+    assert response.status_code == 404
+
+    # Une fois activée, elle est accessible sans connexion et n'utilise pas la base
+    test_app.config['METRICS_ENABLED'] = True
+    response = web_client.get('/metrics/pool')
+    assert response.status_code == 200
+    assert response.json['pool'] == 'TimedQueuePool'
+    assert 'checkouts' in response.json
+    assert sql_queries == []
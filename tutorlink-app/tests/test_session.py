@@ -1,3 +1,4 @@
+import pytest
 from flask import get_flashed_messages
 
 # Tests de la liste des sessions
@@ -176,6 +177,270 @@ def test_10_session_list_with_bad_ue_id(web_client):
             cond = True
     assert cond
 
+def test_11_session_list_pagination(web_client, monkeypatch):
+    """Test de la pagination de la liste des sessions"""
+
+    monkeypatch.setattr('tutorlink.session.PAGE_SIZE', 2)
+
+    # On simule la connexion CAS de l'utilisateur
+    with web_client.session_transaction() as session:
+        session['CAS_USERNAME'] = 'amontarn'
+
+    # Les sessions sont triées par date : 3, 1 puis 2
+    response = web_client.get('/session/list',
+                               query_string=dict(
+                                    date_min='2020-01-01',
+                                    page=2,
+                               ))
+    assert response.status_code == 200
+    html = response.data.decode('utf-8')
+    assert html.count('Tuesday 27 September 2022') == 1
+    assert 'Wednesday 14 September 2022' not in html
+    assert '<input class="page-link" name="page" value="2" type="submit" disabled/>' in html
+
+    # Une page trop grande affiche la dernière page
+    response = web_client.get('/session/list',
+                               query_string=dict(
+                                    date_min='2020-01-01',
+                                    page=99,
+                               ))
+    assert response.status_code == 200
+    assert '<input class="page-link" name="page" value="2" type="submit" disabled/>' in response.data.decode('utf-8')
+
+def test_12_session_list_cursor(web_client, monkeypatch):
+    """Test de la navigation par curseur dans la liste des sessions"""
+
+    import html as html_lib
+    import re
+    monkeypatch.setattr('tutorlink.session.PAGE_SIZE', 2)
+
+    # On simule la connexion CAS de l'utilisateur
+    with web_client.session_transaction() as session:
+        session['CAS_USERNAME'] = 'amontarn'
+
+    # Le lien "suivant" de la première page pointe sur la deuxième page
+    response = web_client.get('/session/list', query_string=dict(date_min='2020-01-01'))
+    html = response.data.decode('utf-8')
+    next_url = html_lib.unescape(re.search(r'href="([^"]*)" aria-label="Next"', html).group(1))
+    assert 'cursor=' in next_url
+    assert 'aria-label="Previous" href' not in html
+
+    response = web_client.get(next_url)
+    assert response.status_code == 200
+    html = response.data.decode('utf-8')
+    assert html.count('Tuesday 27 September 2022') == 1
+    assert 'Wednesday 14 September 2022' not in html
+    assert '<input class="page-link" name="page" value="2" type="submit" disabled/>' in html
+
+    # Le lien "précédent" de la deuxième page revient sur la première page
+    prev_url = html_lib.unescape(re.search(r'href="([^"]*)" aria-label="Previous"', html).group(1))
+    response = web_client.get(prev_url)
+    assert response.status_code == 200
+    html = response.data.decode('utf-8')
+    assert 'Wednesday 14 September 2022' in html
+    assert '<input class="page-link" name="page" value="1" type="submit" disabled/>' in html
+
+def test_13_session_list_invalid_cursor(web_client):
+    """Test d'un curseur invalide dans la liste des sessions"""
+
+    # On simule la connexion CAS de l'utilisateur
+    with web_client.session_transaction() as session:
+        session['CAS_USERNAME'] = 'amontarn'
+
+    response = web_client.get('/session/list', query_string=dict(cursor='invalide'))
+    assert response.status_code == 200
+    assert 'Invalid cursor.' in response.data.decode('utf-8')
+
+def test_14_session_list_query_count(web_client, sql_queries):
+    """Test du nombre de requêtes SQL pour afficher une page de sessions"""
+
+    # On simule la connexion CAS de l'utilisateur
+    with web_client.session_transaction() as session:
+        session['CAS_USERNAME'] = 'amontarn'
+
+    response = web_client.get('/session/list', query_string=dict(date_min='2020-01-01'))
+    assert response.status_code == 200
+
+    # Les modules, UE, types et intervenants des cartes sont chargés avec les sessions
+    assert len(sql_queries) <= 9
+
+def test_16_session_list_reference_cache(web_client, sql_queries):
+    """Test du cache des modules, UE et types proposés par les filtres"""
+
+    from tutorlink import cache
+
+    # On simule la connexion CAS de l'utilisateur
+    with web_client.session_transaction() as session:
+        session['CAS_USERNAME'] = 'amontarn'
+
+    cache.reference_data.bump()
+    response = web_client.get('/session/list', query_string=dict(date_min='2020-01-01'))
+    assert response.status_code == 200
+    assert any('FROM module' in query for query in sql_queries)
+
+    # Une fois en cache, les filtres ne coûtent aucune requête
+    sql_queries.clear()
+    response = web_client.get('/session/list', query_string=dict(date_min='2020-01-01', type='TD'))
+    assert response.status_code == 200
+    assert not any('FROM module' in query or 'FROM ue' in query or 'FROM session_type' in query
+                   for query in sql_queries)
+    assert b'data-subtext="TD"' in response.data
+
+def test_17_session_card_cache(web_client, monkeypatch):
+    """Test du cache des parties communes des cartes des sessions"""
+
+    from tutorlink import cache
+
+    # On simule la connexion CAS de l'utilisateur
+    with web_client.session_transaction() as session:
+        session['CAS_USERNAME'] = 'amontarn'
+
+    cache.session_cards.bump()
+    response = web_client.get('/session/list', query_string=dict(date_min='2020-01-01'))
+    assert response.status_code == 200
+    first_html = response.data.decode('utf-8')
+
+    # Les cartes en cache ne sont plus rendues par Jinja
+    def no_render(*args):
+        raise AssertionError("card rendered again")
+
+    monkeypatch.setattr('tutorlink.session.get_template_attribute', no_render)
+    response = web_client.get('/session/list', query_string=dict(date_min='2020-01-01'))
+    assert response.status_code == 200
+    assert response.data.decode('utf-8') == first_html
+    assert 'Tuesday 27 September 2022' in first_html
+
+    # Un import invalide les cartes
+    cache.session_cards.bump()
+    with pytest.raises(AssertionError):
+        web_client.get('/session/list', query_string=dict(date_min='2020-01-01'))
+
+def test_17_session_card_parts_balanced(test_app, db_objects):
+    """Test des parties en cache des cartes : chacune est un fragment HTML équilibré"""
+
+    from html.parser import HTMLParser
+    from sqlalchemy import select
+    from tutorlink.db import session_card_options
+    from tutorlink.session import session_card_parts
+
+    class TagStack(HTMLParser):
+        def __init__(self):
+            super().__init__()
+            self.stack = []
+
+        def handle_starttag(self, tag, attrs):
+            if tag not in ('br', 'img', 'input'):
+                self.stack.append(tag)
+
+        def handle_endtag(self, tag):
+            assert self.stack and self.stack.pop() == tag
+
+    db_session = db_objects['db_session']
+    Session = db_objects['Session']
+
+    with test_app.test_request_context():
+        session = db_session.execute(
+            select(Session).options(*session_card_options(Session)).where(Session.id == 1)
+            ).unique().scalars().one()
+        for part in session_card_parts(session).values():
+            parser = TagStack()
+            parser.feed(str(part))
+            assert parser.stack == []
+
+def test_18_session_list_etag(web_client, sql_queries):
+    """Test des réponses conditionnelles (ETag) de la liste des sessions"""
+
+    from tutorlink import cache
+
+    # On simule la connexion CAS de l'utilisateur
+    with web_client.session_transaction() as session:
+        session['CAS_USERNAME'] = 'amontarn'
+
+    cache.data.bump()
+    url = '/session/list?date_min=2020-01-01'
+    response = web_client.get(url)
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert response.headers['Last-Modified']
+    assert 'private' in response.headers['Cache-Control']
+
+    # Rien n'a changé : 304 sans aucune requête SQL sur les sessions
+    sql_queries.clear()
+    response = web_client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert not any('FROM session' in query for query in sql_queries)
+
+    # Une autre page a un autre ETag
+    response = web_client.get(url + '&page=2', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+
+    # Une inscription change la version des données
+    cache.data.bump()
+    response = web_client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    etag = response.headers['ETag']
+
+    # Les messages en attente sont toujours affichés
+    with web_client.session_transaction() as session:
+        session['_flashes'] = [('success', 'Message en attente')]
+    response = web_client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert 'Message en attente' in response.data.decode('utf-8')
+
+def test_19_etag_per_user(web_client):
+    """Test des ETag différents d'un utilisateur à l'autre"""
+
+    with web_client.session_transaction() as session:
+        session['CAS_USERNAME'] = 'amontarn'
+    etag = web_client.get('/').headers['ETag']
+
+    with web_client.session_transaction() as session:
+        session['CAS_USERNAME'] = 'cleduff'
+    response = web_client.get('/', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+def test_20_etag_shared_version(web_client, db_objects):
+    """Test de la version des données partagée par tous les workers"""
+
+    from sqlalchemy import text
+
+    db_session = db_objects['db_session']
+
+    with web_client.session_transaction() as session:
+        session['CAS_USERNAME'] = 'amontarn'
+    url = '/session/list?date_min=2020-01-01'
+    etag = web_client.get(url).headers['ETag']
+    assert web_client.get(url, headers={'If-None-Match': etag}).status_code == 304
+
+    # Une inscription traitée par un autre worker change la version dans la base
+    db_session.execute(text(
+        "insert into cache_version (name, version) values ('data', 1) "
+        "on conflict (name) do update set version = cache_version.version + 1"))
+    db_session.commit()
+
+    response = web_client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+def test_15_lectured_session_ids(test_app, db_objects):
+    """Test des identifiants des sessions assurées par un utilisateur"""
+
+    from tutorlink.session import lectured_session_ids
+    from sqlalchemy import select
+
+    with test_app.app_context():
+        db_session = db_objects['db_session']
+        Session = db_objects['Session']
+        sessions = db_session.execute(select(Session).order_by(Session.id)).scalars().all()
+
+        # Seules les sessions de la page sont prises en compte
+        assert lectured_session_ids('cleduff', sessions) == frozenset({1, 2})
+        assert lectured_session_ids('cleduff', sessions[1:]) == frozenset({2})
+        assert lectured_session_ids('amontarn', sessions) == frozenset()
+        assert lectured_session_ids('cleduff', []) == frozenset()
 
 # Tests de la fonction pages_list
 
@@ -373,6 +638,73 @@ def test_09_session_register_inexistant_user(web_client):
             cond = True
     assert cond
 
+def test_10_register_lecturer(test_app, db_objects, sql_queries):
+    """Test de l'inscription en une seule requête et de ses résultats"""
+
+    from tutorlink.auth import UserSnapshot
+    from tutorlink.session import register_lecturer, Registration
+
+    db_session = db_objects['db_session']
+    LecturedBy = db_objects['LecturedBy']
+
+    # benaben gère le module 2 (session 3) mais pas le module 1 (sessions 1 et 2)
+    benaben = UserSnapshot(username='benaben', email='b@mail.com', name='Frédéric', surname='Benaben',
+                           role_id=0, admin=False, managed_module_ids=frozenset({2}))
+
+    with test_app.app_context():
+        assert register_lecturer(1, 'mmirza', benaben) == [Registration.FORBIDDEN]
+        assert register_lecturer(999, 'mmirza', benaben) == [Registration.SESSION_NOT_FOUND]
+        assert register_lecturer(999, 'inconnu', benaben) == [Registration.SESSION_NOT_FOUND,
+                                                              Registration.USER_NOT_FOUND]
+
+        # L'inscription réussie ne coûte qu'une requête
+        sql_queries.clear()
+        assert register_lecturer(3, 'mmirza', benaben) == [Registration.REGISTERED]
+        assert len(sql_queries) == 1
+        assert sql_queries[0].startswith('INSERT INTO lectured_by')
+
+        # Un deuxième clic ne provoque pas d'erreur d'intégrité
+        assert register_lecturer(3, 'mmirza', benaben) == [Registration.ALREADY_REGISTERED]
+
+        db_session.delete(db_session.get(LecturedBy, (3, 'mmirza')))
+        db_session.commit()
+
+def test_11_session_register_fetch(web_client, sql_queries):
+    """Test de l'inscription puis de la désinscription par fetch, qui renvoient la carte de la session"""
+
+    with web_client.session_transaction() as session:
+        session['CAS_USERNAME'] = 'mmirza'
+
+    sql_queries.clear()
+    response = web_client.post('/session/register',
+                               data=dict(session_id=3),
+                               headers={'Accept': 'application/json'})
+    assert response.status_code == 200
+    assert response.json['category'] == 'success'
+    assert response.json['message'] == 'You have successfully registered for the session.'
+    # Seule la carte de la session est rendue, sans redirection ni nouvelle requête de la liste
+    card = response.json['card']
+    assert 'data-session-card="3"' in card
+    assert "type='unregister'" in card
+    assert not any('count(' in query for query in sql_queries)
+
+    # Aucun message n'attend la prochaine page
+    with web_client.session_transaction() as session:
+        assert '_flashes' not in session
+
+    response = web_client.post('/session/register',
+                               data=dict(session_id=3),
+                               headers={'Accept': 'application/json'})
+    assert response.status_code == 400
+    assert response.json == dict(message='mmirza is already registered for this session.', category='error')
+
+    response = web_client.post('/session/unregister',
+                               data=dict(session_id=3),
+                               headers={'Accept': 'application/json'})
+    assert response.status_code == 200
+    assert response.json['message'] == 'You have successfully unregistered from the session.'
+    assert "type='register'" in response.json['card']
+
 # Tests de la désincription à une session
 
 def test_01_session_unregister_no_login(web_client):
@@ -538,3 +870,99 @@ def test_08_session_unregister_other_user_as_admin(web_client, db_objects):
 
     lectured_by = db_session.query(LecturedBy).filter_by(user_username='benaben', session_id=2).first()
     assert lectured_by is None
+
+
+# Tests des inscriptions groupées
+
+def test_01_session_bulk(web_client, db_objects, sql_queries):
+    """Test de l'inscription puis de la désinscription groupées par un gestionnaire de module"""
+
+    from sqlalchemy import select
+
+    db_session = db_objects['db_session']
+    LecturedBy = db_objects['LecturedBy']
+
+    # cleduff gère le module 1 (sessions 1 et 2)
+    with web_client.session_transaction() as session:
+        session['CAS_USERNAME'] = 'cleduff'
+
+    pairs = [dict(session_id=1, username='mmirza'), dict(session_id=2, username='mmirza')]
+    sql_queries.clear()
+    response = web_client.post('/session/bulk', json=dict(register=pairs))
+    assert response.status_code == 200
+    assert response.json['registered'] == pairs
+    # Les vérifications se font en quelques requêtes, quel que soit le nombre de paires
+    assert len([query for query in sql_queries if query.startswith('SELECT')]) <= 4
+
+    db_session.expire_all()
+    registered = db_session.execute(
+        select(LecturedBy.session_id)
+        .where(LecturedBy.user_username == 'mmirza')).scalars().all()
+    assert sorted(registered) == [1, 2]
+
+    response = web_client.post('/session/bulk', json=dict(unregister=pairs))
+    assert response.status_code == 200
+    assert response.json['unregistered'] == pairs
+
+    registered = db_session.execute(
+        select(LecturedBy.session_id)
+        .where(LecturedBy.user_username == 'mmirza')).scalars().all()
+    assert registered == []
+
+def test_02_session_bulk_errors(web_client, db_objects):
+    """Test des inscriptions groupées invalides : rien n'est modifié"""
+
+    from sqlalchemy import select
+
+    db_session = db_objects['db_session']
+    LecturedBy = db_objects['LecturedBy']
+
+    with web_client.session_transaction() as session:
+        session['CAS_USERNAME'] = 'cleduff'
+
+    # cleduff ne gère pas le module 2 (session 3)
+    response = web_client.post('/session/bulk', json=dict(register=[
+        dict(session_id=1, username='mmirza'),
+        dict(session_id=3, username='mmirza'),
+        dict(session_id=999, username='inconnu'),
+    ], unregister=[
+        dict(session_id=1, username='gslaoui'),
+    ]))
+    assert response.status_code == 400
+    assert response.json['errors'] == [
+        "register mmirza / session 3: You are not allowed to register other users.",
+        "register inconnu / session 999: The session with id 999 does not exist. Invalid username.",
+        "unregister gslaoui / session 1: gslaoui is not registered for this session.",
+    ]
+
+    db_session.expire_all()
+    assert db_session.execute(
+        select(LecturedBy)
+        .where(LecturedBy.user_username == 'mmirza')).first() is None
+
+    # Corps invalides
+    response = web_client.post('/session/bulk', data='pas du json')
+    assert response.status_code == 400
+    response = web_client.post('/session/bulk', json=dict(register=[dict(session_id='1')]))
+    assert response.status_code == 400
+    assert 'needs a session_id and a username' in response.json['errors'][0]
+
+def test_03_session_bulk_malformed(web_client):
+    """Test des corps mal formés de /session/bulk : erreur 400 et non 500"""
+
+    with web_client.session_transaction() as session:
+        session['CAS_USERNAME'] = 'cleduff'
+
+    for body in (dict(register=5), dict(register=None), dict(unregister='1'), dict(register={})):
+        response = web_client.post('/session/bulk', json=body)
+        assert response.status_code == 400
+        assert 'must be a list' in response.json['errors'][0]
+
+    for item in (5, None, 'session_id', [1, 'mmirza'], dict(username='mmirza')):
+        response = web_client.post('/session/bulk', json=dict(register=[item]))
+        assert response.status_code == 400
+        assert 'needs a session_id and a username' in response.json['errors'][0]
+
+    response = web_client.post('/session/bulk', json=dict(register=[dict(session_id=True, username='mmirza')]))
+    assert response.status_code == 400
+    assert 'Invalid session id or username' in response.json['errors'][0]
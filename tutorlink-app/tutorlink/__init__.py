@@ -21,6 +21,9 @@ def create_app(test_config=None):
 
     # lecture du fichier de configuration
     app.config.from_envvar('TUTORLINK_SETTINGS')
+    # la configuration des tests remplace celle du fichier
+    if test_config is not None:
+        app.config.update(test_config)
     # for key, value in app.config.items():
     #     click.echo(f"{key}: {value}")
 
@@ -37,8 +40,18 @@ def create_app(test_config=None):
 
     db.init_app(app)
 
+    # the caches shared between the workers
+    from tutorlink import cache
+
+    cache.init_app(app)
+
+    # the import jobs interrupted by a previous run
+    from tutorlink import jobs
+
+    jobs.init_app(app)
+
     # apply the blueprints to the app
-    from tutorlink import auth, home, profile, session, data, admin_panel
+    from tutorlink import auth, home, profile, session, data, admin_panel, metrics, api, calendar
 
     app.register_blueprint(auth.bp)
     app.register_blueprint(session.bp)
@@ -46,6 +59,9 @@ def create_app(test_config=None):
     app.register_blueprint(profile.bp)
     app.register_blueprint(data.bp)
     app.register_blueprint(admin_panel.bp)
+    app.register_blueprint(metrics.bp)
+    app.register_blueprint(api.bp)
+    app.register_blueprint(calendar.bp)
 
     # make url_for('index') == url_for('blog.index')
     # in another app, you might define a separate main index here with
@@ -4,8 +4,8 @@ from flask import redirect
 from flask import url_for
 from flask import flash
 
-from tutorlink.db import db_session, User
-from tutorlink.auth import login_required, admin_required
+from tutorlink.db import db_session, User, read_only
+from tutorlink.auth import login_required, admin_required, invalidate_user
 
 from sqlalchemy import select
 
@@ -16,6 +16,7 @@ bp = Blueprint("admin", __name__, url_prefix="/admin")
 @bp.route("/panel")
 @login_required
 @admin_required
+@read_only
 def admin_panel():
     """Show the admin panel of the application"""
     users = db_session.execute(select(User)).scalars().all()
@@ -44,6 +45,7 @@ def grant_admin(username):
     else:
         user.admin = True
         db_session.commit()
+        invalidate_user(username)
         flash(f"User {username} has been granted admin privileges.", "success")
     return redirect(url_for('admin.admin_panel'))
 
@@ -72,5 +74,6 @@ def revoke_admin(username):
     else:
         user.admin = False
         db_session.commit()
+        invalidate_user(username)
         flash(f"User {username} has been revoked admin privileges.", "error")
     return redirect(url_for('admin.admin_panel'))
@@ -0,0 +1,231 @@
+import datetime
+import json
+
+from flask import Blueprint, request, g, current_app
+from sqlalchemy import select, tuple_
+from sqlalchemy.orm import joinedload, selectinload
+
+from tutorlink import cache
+from tutorlink.auth import login_required
+from tutorlink.db import db_session, Session, LecturedBy, read_only
+from tutorlink.home import open_session_criteria
+from tutorlink.session import session_filters, lectured_session_ids, encode_cursor, decode_cursor
+
+try:
+    # orjson serializes several times faster than json, and natively handles datetimes
+    import orjson
+except ImportError:
+    orjson = None
+
+
+bp = Blueprint("api", __name__, url_prefix="/api")
+
+# Default and maximum number of sessions returned by a call
+API_LIMIT = 50
+API_MAX_LIMIT = 200
+
+# The fields of a session, with the relationship each one needs to load (None if none)
+SESSION_FIELDS = {
+    'id': None,
+    'date_start': None,
+    'date_end': None,
+    'salle': None,
+    'group_name': None,
+    'module': 'module',
+    'ue': 'ue',
+    'type': 'session_type',
+    'lecturers': 'lectured_by_users',
+    'registered': None,
+}
+
+# The fields returned when the call does not select any
+DEFAULT_FIELDS = ('id', 'date_start', 'date_end', 'module', 'type', 'registered')
+
+
+def json_response(data, status=200):
+    """
+    Return a compact JSON response, serialized with orjson when it is installed.
+
+    Parameters:
+        data (object): The data to send, which may contain datetimes.
+        status (int): The status code of the response.
+    """
+    if orjson is not None:
+        body = orjson.dumps(data)
+    else:
+        body = json.dumps(data, separators=(',', ':'), default=datetime.datetime.isoformat)
+    return current_app.response_class(body, status=status, mimetype='application/json')
+
+
+def selected_fields(args):
+    """
+    Read the sparse fieldset of a call, e.g. ?fields=id,date_start,lecturers
+
+    Returns:
+        tuple: The selected fields, in the order of SESSION_FIELDS.
+
+    Raises:
+        ValueError: If a field is unknown.
+    """
+    fields = args.get('fields', '')
+    if fields == '':
+        return DEFAULT_FIELDS
+
+    names = set(fields.split(','))
+    unknown = names - SESSION_FIELDS.keys()
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}.")
+    return tuple(name for name in SESSION_FIELDS if name in names)
+
+
+def session_load_options(fields):
+    """Return the loader options of the relationships needed by the selected fields only."""
+    options = []
+    for field in fields:
+        relationship = SESSION_FIELDS[field]
+        if relationship == 'lectured_by_users':
+            options.append(selectinload(Session.lectured_by_users))
+        elif relationship is not None:
+            options.append(joinedload(getattr(Session, relationship)))
+    return options
+
+
+def session_to_dict(session, fields, lectured_ids):
+    """
+    Return the selected fields of a session, ready to be sent as JSON.
+
+    Parameters:
+        session (Session): The session, with the relationships of the fields loaded.
+        fields (tuple): The fields to return.
+        lectured_ids (frozenset): The ids of the sessions lectured by the logged-in user.
+    """
+    result = {}
+    for field in fields:
+        if field == 'module':
+            result['module'] = dict(id=session.module.id, name=session.module.name, label=session.module.label)
+        elif field == 'ue':
+            result['ue'] = dict(id=session.ue.id, name=session.ue.name, label=session.ue.label)
+        elif field == 'type':
+            result['type'] = dict(id=session.session_type.id, name=session.session_type.name)
+        elif field == 'lecturers':
+            result['lecturers'] = [dict(username=user.username, name=user.name, surname=user.surname)
+                                   for user in session.lectured_by_users]
+        elif field == 'registered':
+            result['registered'] = session.id in lectured_ids
+        else:
+            result[field] = getattr(session, field)
+    return result
+
+
+def sessions_response(order, fields, limit):
+    """
+    Fetch a page of sessions and return them as JSON, with the cursor of the next page.
+
+    Parameters:
+        order (Select): The query of the sessions, ordered by (date_start, id).
+        fields (tuple): The fields to return.
+        limit (int): The number of sessions of the page.
+    """
+    # One more session is fetched to know whether there is a next page
+    sessions = db_session.execute(
+        order
+        .options(*session_load_options(fields))
+        .limit(limit + 1)
+        ).scalars().all()
+    next_cursor = encode_cursor('next', sessions[limit - 1]) if len(sessions) > limit else None
+    sessions = sessions[:limit]
+
+    lectured_ids = lectured_session_ids(g.user.username, sessions) if 'registered' in fields else frozenset()
+    return json_response({
+        'sessions': [session_to_dict(session, fields, lectured_ids) for session in sessions],
+        'next_cursor': next_cursor,
+    })
+
+
+def read_page(args, order):
+    """
+    Read the fields, limit and cursor of a call, and apply the cursor to a query of sessions.
+
+    Returns:
+        tuple: The selected fields, the limit and the query, ordered by (date_start, id).
+
+    Raises:
+        ValueError: If an argument is invalid.
+    """
+    fields = selected_fields(args)
+
+    limit = args.get('limit', API_LIMIT, type=int)
+    if not 1 <= limit <= API_MAX_LIMIT:
+        raise ValueError(f"The limit must be between 1 and {API_MAX_LIMIT}.")
+
+    cursor = args.get('cursor', '')
+    if cursor != '':
+        try:
+            direction, cursor_date_start, cursor_id = decode_cursor(cursor)
+        except ValueError:
+            raise ValueError("Invalid cursor.")
+        if direction != 'next':
+            raise ValueError("Invalid cursor.")
+        order = order.where(tuple_(Session.date_start, Session.id) > tuple_(cursor_date_start, cursor_id))
+
+    return fields, limit, order.order_by(Session.date_start, Session.id)
+
+
+@bp.route("/sessions", methods=["GET"])
+@login_required
+@cache.conditional
+@read_only
+def sessions():
+    """
+    Return the sessions matching the filters of the session list, as JSON.
+
+    Arguments:
+        type, module, ue, date_min, date_max: The filters of session.session_list.
+        fields: The comma-separated fields to return (see SESSION_FIELDS).
+        limit: The number of sessions to return (API_LIMIT by default).
+        cursor: The next_cursor of the previous call.
+
+    Only the relationships needed by the selected fields are loaded.
+    """
+    filters, criteria, error = session_filters(request.args)
+    if error != "":
+        return json_response({'errors': [error.strip()]}, 400)
+
+    try:
+        fields, limit, order = read_page(request.args, select(Session).where(*criteria))
+    except ValueError as exception:
+        return json_response({'errors': [str(exception)]}, 400)
+
+    return sessions_response(order, fields, limit)
+
+
+@bp.route("/sessions/mine", methods=["GET"])
+@login_required
+@cache.conditional
+@read_only
+def my_sessions():
+    """Return the upcoming sessions lectured by the logged-in user, as JSON."""
+    try:
+        fields, limit, order = read_page(request.args, (
+            select(Session)
+            .join(LecturedBy, Session.id == LecturedBy.session_id)
+            .where(LecturedBy.user_username == g.user.username)
+            .where(Session.date_start >= datetime.datetime.now())))
+    except ValueError as exception:
+        return json_response({'errors': [str(exception)]}, 400)
+
+    return sessions_response(order, fields, limit)
+
+
+@bp.route("/sessions/urgent", methods=["GET"])
+@login_required
+@cache.conditional
+@read_only
+def urgent_sessions():
+    """Return the upcoming sessions without lecturers, as JSON."""
+    try:
+        fields, limit, order = read_page(request.args, select(Session).where(*open_session_criteria()))
+    except ValueError as exception:
+        return json_response({'errors': [str(exception)]}, 400)
+
+    return sessions_response(order, fields, limit)
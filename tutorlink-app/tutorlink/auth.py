@@ -1,4 +1,5 @@
 import functools
+from dataclasses import dataclass
 from flask import Blueprint
 from flask import flash
 from flask import g
@@ -8,8 +9,10 @@ from flask import request
 from flask import session
 from flask import url_for
 from flask import abort
+from flask import current_app
 
-from tutorlink.db import db_session, User, Role
+from tutorlink import cache
+from tutorlink.db import db_session, User, Role, ManagedBy
 from sqlalchemy import select
 
 
@@ -37,35 +40,103 @@ def admin_required(function):
         return function(*args, **kwargs)
     return wrapper
 
+@dataclass(frozen=True)
+class UserSnapshot:
+    """
+    The fields of the logged-in user needed by the views and the templates.
+
+    It is stored in ``g.user`` instead of the User object, so that it can be
+    cached between requests. Views which modify the user must load the User
+    object from the database and call invalidate_user afterwards.
+    """
+    username: str
+    email: str
+    name: str
+    surname: str
+    role_id: int
+    admin: bool
+    managed_module_ids: frozenset
+    calendar_nonce: str = None
+
+    @property
+    def complete(self):
+        """True if the user has filled all the registration fields."""
+        return bool(self.email and self.name and self.surname and self.role_id is not None)
+
+def load_user_snapshot(username):
+    """
+    Return the snapshot of a user, from the cache or from the database.
+
+    Parameters:
+        username (str): The username of the user.
+
+    Returns:
+        UserSnapshot: The snapshot, or None if the user is not registered.
+    """
+    return cache.users.get_or_set(username,
+                                  lambda: _read_user_snapshot(username),
+                                  ttl=current_app.config.get('USER_CACHE_TTL'))
+
+def _read_user_snapshot(username):
+    """Read the snapshot of a user from the database."""
+    user = db_session.execute(
+        select(User)
+        .where(User.username == username)
+    ).scalars().first()
+
+    if user is None:
+        return None
+
+    managed_module_ids = db_session.execute(
+        select(ManagedBy.module_id)
+        .where(ManagedBy.user_username == username)
+    ).scalars()
+
+    return UserSnapshot(username=user.username,
+                        email=user.email,
+                        name=user.name,
+                        surname=user.surname,
+                        role_id=user.role_id,
+                        admin=user.admin,
+                        managed_module_ids=frozenset(managed_module_ids),
+                        calendar_nonce=user.calendar_nonce)
+
+def invalidate_user(username):
+    """Forget the cached snapshot of a user, after a modification of its profile."""
+    cache.users.invalidate(username)
+
+# Endpoints and blueprints served without loading the user: static files,
+# health check, monitoring, CAS callbacks and calendar feeds (authenticated
+# by their token) never use g.user
+ANONYMOUS_ENDPOINTS = frozenset(["static", "hello"])
+ANONYMOUS_BLUEPRINTS = frozenset(["cas", "metrics", "calendar"])
+
+def is_anonymous_endpoint():
+    """True if the current request does not need the logged-in user."""
+    return (request.endpoint in ANONYMOUS_ENDPOINTS
+            or request.blueprint in ANONYMOUS_BLUEPRINTS)
+
 @bp.before_app_request
 def load_logged_in_user():
-    """If a user id is stored in the session, load the user object from
-    the database into ``g.user``."""
+    """If a user id is stored in the session, load the snapshot of the user
+    into ``g.user``."""
     username = session.get("CAS_USERNAME")
 
-    # Not logged in
-    if username is None:
+    # Not logged in, or no need to know who is logged in
+    if username is None or is_anonymous_endpoint():
         g.user = None
     
     # Logged in with CAS
     else:
-        g.user = db_session.execute(
-            select(User)
-            .where(User.username == username)
-        ).scalars().first()
+        g.user = load_user_snapshot(username)
 
         # User is not registered or some information is missing
         # Redirect every requests to the registration page except for 
-        # the request to the registration page itself, the logout page and the static files
-        authorized_routes = ["auth.register", "cas.logout", "static"]
-
-        if (g.user is None
-            or not (g.user.email
-                    and g.user.name
-                    and g.user.surname
-                    and g.user.role_id is not None)):
+        # the request to the registration page itself (the logout page and the
+        # static files are anonymous endpoints)
+        if g.user is None or not g.user.complete:
             
-            if request.endpoint not in authorized_routes:
+            if request.endpoint != "auth.register":
                 return redirect(url_for("auth.register"))
 
 
@@ -81,11 +152,7 @@ def register():
 
     If the user is already registered and all information is present, redirect to the index page.
     """
-    if (g.user is not None
-        and g.user.email
-        and g.user.name
-        and g.user.surname
-        and g.user.role_id is not None):
+    if g.user is not None and g.user.complete:
         return redirect(url_for("index"))
     
     roles = db_session.execute(
@@ -145,6 +212,10 @@ def register():
                 )
                 db_session.add(new_user)
             db_session.commit()
+            invalidate_user(username)
+            # An imported lecturer may change the name shown on the cards
+            cache.session_cards.bump()
+            cache.data.bump()
             flash("Registration ok", "success")
             return redirect(url_for("index"))
 
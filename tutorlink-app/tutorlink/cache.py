@@ -0,0 +1,371 @@
+import functools
+import hashlib
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+from flask import g
+from flask import has_request_context
+from flask import make_response
+from flask import request
+from flask import session as flask_session
+from sqlalchemy import text
+
+
+class TTLCache:
+    """
+    A small in-process cache whose entries expire after `ttl` seconds.
+
+    When more than `maxsize` entries are stored, the least recently used
+    entry is evicted. The cache is shared by the threads of the process, so
+    every access is protected by a lock.
+    """
+
+    def __init__(self, maxsize=128, ttl=60, timer=time.monotonic):
+        """
+        Parameters:
+            maxsize (int): The maximum number of entries.
+            ttl (float): The default lifetime of an entry, in seconds.
+            timer (callable): The clock used to expire the entries.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the value stored for `key`, or `default` if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at <= self.timer():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """
+        Store a value, evicting the least recently used entry if the cache is full.
+
+        Parameters:
+            key (hashable): The key of the entry.
+            value (object): The value to store.
+            ttl (float): The lifetime of the entry, `self.ttl` if None.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._entries[key] = (self.timer() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get_or_set(self, key, function, ttl=None):
+        """
+        Return the value stored for `key`, computing and storing it with `function()` if needed.
+
+        Returns:
+            object: The cached or computed value.
+        """
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = function()
+            self.set(key, value, ttl)
+        return value
+
+    def invalidate(self, key=None):
+        """Remove the entry of `key`, or every entry if no key is given."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class LocalBackend:
+    """
+    In-process backend of VersionedCache, an LRU of `maxsize` entries.
+
+    The entries expire after `ttl` seconds, so that the values of the older
+    versions are not kept for long, even when the versions are only known
+    to this worker (LocalCounters).
+    """
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, key):
+        return self._entries.get(key)
+
+    def set(self, key, value, ttl=None):
+        self._entries.set(key, value, ttl)
+
+
+class RedisBackend:
+    """
+    Backend of VersionedCache shared by all the workers, on a Redis-compatible server.
+
+    Any client with the get / set(ex=...) methods of redis.Redis can be used.
+    The values are pickled.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key):
+        value = self.client.get(key)
+        return None if value is None else pickle.loads(value)
+
+    def set(self, key, value, ttl=None):
+        ttl = None if ttl is None or ttl == float('inf') else int(ttl)
+        self.client.set(key, pickle.dumps(value), ex=ttl)
+
+
+class LocalCounters:
+    """
+    In-process versions of VersionedCache.
+
+    The versions are kept apart from the values and never evicted: an
+    evicted version would start again from 0, and the entries and ETags of
+    the older versions would become valid again.
+    """
+
+    def __init__(self):
+        self._versions = {}
+        self._bumped_at = {}
+        self._lock = threading.Lock()
+
+    def version(self, key):
+        with self._lock:
+            return self._versions.get(key, 0)
+
+    def bump(self, key):
+        with self._lock:
+            self._versions[key] = self._versions.get(key, 0) + 1
+            self._bumped_at[key] = time.time()
+            return self._versions[key]
+
+    def bumped_at(self, key):
+        with self._lock:
+            return self._bumped_at.get(key)
+
+
+class RedisCounters:
+    """Versions of VersionedCache shared by all the workers, as native Redis integers."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def version(self, key):
+        return int(self.client.get(f"{key}:version") or 0)
+
+    def bump(self, key):
+        self.client.set(f"{key}:bumped_at", repr(time.time()))
+        return self.client.incr(f"{key}:version")
+
+    def bumped_at(self, key):
+        value = self.client.get(f"{key}:bumped_at")
+        return None if value is None else float(value)
+
+
+class DatabaseCounters:
+    """
+    Versions of VersionedCache shared by all the workers, in the cache_version table.
+
+    A version is read once per request and kept in `g`: the request sees a
+    consistent version, and the pages with many cached parts cost a single
+    query. The bumps run in their own transaction, after the changes they
+    announce are committed.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def version(self, key):
+        return self._read(key)[0]
+
+    def bump(self, key):
+        with self.engine.begin() as connection:
+            row = connection.execute(text(
+                "insert into cache_version (name, version) values (:name, 1) "
+                "on conflict (name) do update "
+                "set version = cache_version.version + 1, bumped_at = now() "
+                "returning version, extract(epoch from bumped_at)"), dict(name=key)).one()
+        value = (row[0], float(row[1]))
+        self._memo()[key] = value
+        return value[0]
+
+    def bumped_at(self, key):
+        return self._read(key)[1]
+
+    def _read(self, key):
+        memo = self._memo()
+        if key not in memo:
+            with self.engine.connect() as connection:
+                row = connection.execute(text(
+                    "select version, extract(epoch from bumped_at) from cache_version "
+                    "where name = :name"), dict(name=key)).first()
+            memo[key] = (0, None) if row is None else (row[0], float(row[1]))
+        return memo[key]
+
+    def _memo(self):
+        # Outside of a request (imports, commands), every read goes to the database
+        if not has_request_context():
+            return {}
+        return g.setdefault('cache_versions', {})
+
+
+class VersionedCache:
+    """
+    A cache whose entries are all invalidated at once by bumping its version.
+
+    The version is part of the keys, so that bump() works the same on every
+    backend: the entries of the previous versions are never read again and
+    are evicted by the backend.
+    """
+
+    def __init__(self, namespace, backend=None, ttl=None, counters=None):
+        """
+        Parameters:
+            namespace (str): The prefix of the keys of the cache.
+            backend (LocalBackend | RedisBackend): The storage of the values, LocalBackend() by default.
+            ttl (float): The lifetime of the entries in seconds, None for the default of the backend.
+            counters (LocalCounters | RedisCounters | DatabaseCounters): The storage of the versions,
+                LocalCounters() by default.
+        """
+        self.namespace = namespace
+        self.backend = backend or LocalBackend()
+        self.ttl = ttl
+        self.counters = counters or LocalCounters()
+
+    def version(self, scope=None):
+        """Return the current version of the cache, or of one `scope` of it (e.g. a user)."""
+        return self.counters.version(self._key(None, scope))
+
+    def bump(self, scope=None):
+        """Invalidate every entry of the cache, or only the entries of `scope`."""
+        return self.counters.bump(self._key(None, scope))
+
+    def bumped_at(self, scope=None):
+        """Return the timestamp of the last bump, or None if the version was never bumped."""
+        return self.counters.bumped_at(self._key(None, scope))
+
+    def get(self, name, scope=None):
+        """Return the value of `name` for the current version, or None if it is not cached."""
+        return self.backend.get(self._key(f"{self.version(scope)}:{name}", scope))
+
+    def set(self, name, value, scope=None):
+        """Store the value of `name` for the current version."""
+        self.backend.set(self._key(f"{self.version(scope)}:{name}", scope), value, self.ttl)
+
+    def get_or_set(self, name, function, scope=None):
+        """
+        Return the value of `name` for the current version, computing it with `function()` if needed.
+
+        The values must be picklable plain data (not ORM objects), to be shared between requests.
+        """
+        value = self.get(name, scope)
+        if value is None:
+            value = function()
+            self.set(name, value, scope)
+        return value
+
+    def _key(self, name, scope):
+        key = self.namespace if scope is None else f"{self.namespace}:{scope}"
+        return key if name is None else f"{key}:{name}"
+
+
+def conditional(view):
+    """
+    Answer 304 Not Modified to a GET whose ETag is still valid, without running the view.
+
+    The ETag combines the data version (bumped by the imports and the
+    registrations), the URL, the fields of the logged-in user and a time
+    bucket of ETAG_TIME_BUCKET seconds, since the pages list the upcoming
+    sessions. Pages with pending flash messages are always rendered.
+    """
+    @functools.wraps(view)
+    def wrap(*args, **kwargs):
+        if '_flashes' in flask_session:
+            return view(*args, **kwargs)
+
+        bucket = int(time.time() // current_app.config.get('ETAG_TIME_BUCKET', 300))
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(repr((data.version(), request.full_path, g.user, bucket)).encode('utf-8'))
+        etag = digest.hexdigest()
+        last_modified = data.bumped_at()
+
+        if etag in request.if_none_match:
+            response = current_app.response_class(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+        response.set_etag(etag)
+        if last_modified is not None:
+            response.last_modified = last_modified
+        # The pages are per user: they can be kept by the browser but must be revalidated
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+    return wrap
+
+
+def init_app(app):
+    """
+    Share the versions of the caches between the workers.
+
+    With REDIS_URL, the values and the versions are kept on the Redis
+    server. Without it, each worker keeps its own values, but the versions
+    are read in the cache_version table of the database: a bump made by any
+    worker changes the keys and the ETags of all of them.
+
+    The redis package is only needed when REDIS_URL is set.
+    """
+    shared_caches = (reference_data, session_cards, data, calendars)
+    if app.config.get('REDIS_URL'):
+        import redis
+
+        client = redis.Redis.from_url(app.config['REDIS_URL'])
+        for versioned_cache in shared_caches:
+            versioned_cache.backend = RedisBackend(client)
+            versioned_cache.counters = RedisCounters(client)
+    else:
+        from tutorlink import db
+
+        counters = DatabaseCounters(db.engine)
+        for versioned_cache in shared_caches:
+            versioned_cache.counters = counters
+
+
+# Number of upcoming sessions without lecturers, shown on the home page.
+# Invalidated when a registration or an import changes the lecturers.
+open_sessions = TTLCache(maxsize=1, ttl=60)
+
+# Snapshots of the logged-in users, keyed by username (see auth.load_user_snapshot).
+# Invalidated when the profile, the admin flag or the registration of a user changes.
+users = TTLCache(maxsize=1024, ttl=300)
+
+# Modules, UE and session types, which only change on a Synapses import.
+# Bumped by SynapsesImporter.finish.
+reference_data = VersionedCache('reference')
+
+# Rendered parts of the session cards (see session.session_card_parts).
+# Bumped by an import, or when a user changes the name shown on the cards.
+session_cards = VersionedCache('card-parts', LocalBackend(maxsize=4096), ttl=3600)
+
+# Version of the sessions and their lecturers, used in the ETags of the
+# listing pages (see conditional). Bumped by the imports and the registrations.
+data = VersionedCache('data')
+
+# iCalendar feeds of the lecturers (see calendar.feed), versioned per user.
+# Bumped for a user by their registrations and by the imports touching their sessions.
+calendars = VersionedCache('calendar', LocalBackend(maxsize=1024), ttl=3600)
@@ -0,0 +1,213 @@
+import datetime
+import hashlib
+import secrets
+
+from flask import Blueprint, current_app, request, abort, stream_with_context
+from itsdangerous import BadSignature, URLSafeSerializer
+from sqlalchemy import select
+
+from tutorlink import cache
+from tutorlink.db import db_session, Session, LecturedBy, Module, Ue, SessionType, User
+
+
+bp = Blueprint("calendar", __name__, url_prefix="/calendar")
+
+# Number of sessions fetched at a time from the database while streaming a feed
+FEED_BATCH_SIZE = 500
+
+
+def _serializer():
+    return URLSafeSerializer(current_app.secret_key, salt='calendar-feed')
+
+
+def feed_token(username, nonce=None):
+    """
+    Return the token of the calendar feed of a user.
+
+    Calendar clients cannot log in with CAS: the feed URL carries the
+    username and the calendar nonce of the user, signed with the SECRET_KEY
+    of the application. Changing the nonce (see new_calendar_nonce) revokes
+    the previous URLs.
+
+    Parameters:
+        username (str): The username of the user.
+        nonce (str): The calendar_nonce of the user, None if it was never set.
+    """
+    return _serializer().dumps([username, nonce or ''])
+
+
+def read_feed_token(token):
+    """
+    Return the username and the nonce signed in a feed token.
+
+    The tokens signed before the nonces only carry the username: they are
+    valid as long as the nonce of the user is not set.
+
+    Raises:
+        BadSignature: If the token was not built by feed_token.
+    """
+    payload = _serializer().loads(token)
+    if isinstance(payload, str):
+        return payload, ''
+    if (not isinstance(payload, list) or len(payload) != 2
+            or not all(isinstance(value, str) for value in payload)):
+        raise BadSignature("Malformed feed token.")
+    return payload[0], payload[1]
+
+
+def new_calendar_nonce():
+    """Return a new random calendar nonce, to store in "user".calendar_nonce."""
+    return secrets.token_urlsafe(16)
+
+
+def escape_text(value):
+    """Escape a TEXT value of iCalendar (RFC 5545, 3.3.11)."""
+    return (str(value)
+            .replace('\\', '\\\\')
+            .replace(';', '\\;')
+            .replace(',', '\\,')
+            .replace('\r\n', '\\n')
+            .replace('\n', '\\n'))
+
+
+def content_line(name, value):
+    """
+    Return a content line of iCalendar, folded every 75 octets and ended by CRLF.
+
+    Parameters:
+        name (str): The name of the property, with its parameters.
+        value (str): The value of the property, already escaped.
+    """
+    line = f"{name}:{value}".encode('utf-8')
+    chunks = []
+    # The folded lines start with a space: 74 octets of content are left
+    while len(line) > (74 if chunks else 75):
+        cut = 74 if chunks else 75
+        # Never cut a UTF-8 character: continuation bytes are 0b10xxxxxx
+        while line[cut] & 0xC0 == 0x80:
+            cut -= 1
+        chunks.append(line[:cut])
+        line = line[cut:]
+    chunks.append(line)
+    return b"\r\n ".join(chunks).decode('utf-8') + "\r\n"
+
+
+def ics_datetime(value):
+    """Format a timestamp of the database, in local time, as a floating DATE-TIME."""
+    return value.strftime('%Y%m%dT%H%M%S')
+
+
+def feed_events(username, stamp):
+    """
+    Yield the iCalendar feed of the sessions lectured by a user, one event at a time.
+
+    The sessions are read in batches of FEED_BATCH_SIZE plain rows, so that
+    a feed of any size is sent without loading it whole in memory.
+
+    Parameters:
+        username (str): The username of the lecturer.
+        stamp (datetime): The UTC time of the generation of the feed (DTSTAMP).
+    """
+    yield content_line('BEGIN', 'VCALENDAR')
+    yield content_line('VERSION', '2.0')
+    yield content_line('PRODID', '-//TutorLink//Sessions//FR')
+    yield content_line('CALSCALE', 'GREGORIAN')
+    yield content_line('X-WR-CALNAME', escape_text('TutorLink'))
+    timezone = current_app.config.get('CALENDAR_TIMEZONE')
+    if timezone:
+        yield content_line('X-WR-TIMEZONE', timezone)
+
+    rows = db_session.execute(
+        select(Session.id, Session.date_start, Session.date_end, Session.salle, Session.group_name,
+               Module.name.label('module_name'), Module.label.label('module_label'),
+               Ue.label.label('ue_label'), SessionType.name.label('type_name'))
+        .join(LecturedBy, Session.id == LecturedBy.session_id)
+        .join(Module, Session.module_id == Module.id)
+        .join(Ue, Session.ue_id == Ue.id)
+        .join(SessionType, Session.type == SessionType.id)
+        .where(LecturedBy.user_username == username)
+        .order_by(Session.date_start, Session.id)
+        .execution_options(yield_per=FEED_BATCH_SIZE))
+
+    dtstamp = stamp.strftime('%Y%m%dT%H%M%SZ')
+    for row in rows:
+        description = f"{row.module_name}\nUE : {row.ue_label}"
+        if row.group_name:
+            description += f"\nGroupes : {row.group_name}"
+
+        event = [
+            content_line('BEGIN', 'VEVENT'),
+            content_line('UID', f"session-{row.id}@tutorlink"),
+            content_line('DTSTAMP', dtstamp),
+            content_line('DTSTART', ics_datetime(row.date_start)),
+            content_line('DTEND', ics_datetime(row.date_end)),
+            content_line('SUMMARY', escape_text(f"{row.module_label} - {row.type_name}")),
+            content_line('DESCRIPTION', escape_text(description)),
+        ]
+        if row.salle:
+            event.append(content_line('LOCATION', escape_text(row.salle)))
+        event.append(content_line('END', 'VEVENT'))
+        yield ''.join(event)
+
+    yield content_line('END', 'VCALENDAR')
+
+
+@bp.route("/<token>.ics", methods=["GET"])
+def feed(token):
+    """
+    Return the iCalendar feed of the sessions lectured by a user.
+
+    The token must carry the current calendar nonce of the user. Calendar
+    clients poll the feed every few minutes: it is versioned per user in
+    cache.calendars, bumped by the registrations of the user and by the
+    imports touching their sessions. An unchanged feed is answered with 304
+    Not Modified after reading the nonce and the version only, and a changed
+    one is sent from the cache, or streamed from the database and cached on
+    the way.
+    """
+    try:
+        username, nonce = read_feed_token(token)
+    except BadSignature:
+        abort(404)
+
+    # The nonce is read on every request: a revoked URL stops working at once
+    current_nonce = db_session.execute(
+        select(User.calendar_nonce)
+        .where(User.username == username)).first()
+    if current_nonce is None or (current_nonce[0] or '') != nonce:
+        abort(404)
+
+    # The feed is read on the primary database, not on the replica: a lagging
+    # replica would store an outdated feed under the new version
+    version = cache.calendars.version(username)
+    etag = hashlib.blake2b(f"{username}:{version}".encode('utf-8'), digest_size=16).hexdigest()
+    last_modified = cache.calendars.bumped_at(username)
+
+    if etag in request.if_none_match:
+        response = current_app.response_class(status=304)
+    else:
+        body = cache.calendars.get('feed', username)
+        if body is None:
+            body = stream_with_context(cached_feed(username, version))
+        response = current_app.response_class(body, mimetype='text/calendar')
+        response.headers['Content-Disposition'] = 'inline; filename="tutorlink.ics"'
+
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # The token is in the URL: the feed must not be kept by shared caches
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def cached_feed(username, version):
+    """Stream the feed of a user, and store it in cache.calendars once it is complete."""
+    chunks = []
+    for chunk in feed_events(username, datetime.datetime.now(datetime.timezone.utc)):
+        chunks.append(chunk)
+        yield chunk
+
+    # A registration during the streaming makes this feed outdated: do not cache it
+    if cache.calendars.version(username) == version:
+        cache.calendars.set('feed', ''.join(chunks), username)
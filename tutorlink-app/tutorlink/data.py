@@ -1,19 +1,48 @@
+import codecs
+import functools
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
 import pandas as pd
 import re
 
 from flask import Blueprint
+from flask import current_app
 from flask import flash
 from flask import g
+from flask import jsonify
 from flask import render_template
 from flask import request
 from flask import abort
 
 from tutorlink.db import db_session, User, Role, Session, SessionType, Module, Ue, LecturedBy
-from sqlalchemy import select
-from tutorlink.auth import login_required
+from sqlalchemy import select, bindparam, func, literal, any_
+from sqlalchemy import Integer
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from tutorlink.auth import login_required, admin_required
+from tutorlink import cache
+from tutorlink import jobs
 
 bp = Blueprint("data", __name__, url_prefix="/data")
 
+# Roles declared in the database, name => id
+ROLES = {'Autre': -1,
+         'Professeur': 0,
+         'Doctorant': 1,
+         'Vacataire': 2}
+
+# Maximum number of rows sent in a single INSERT / UPDATE / DELETE statement
+BATCH_SIZE = 1000
+
+# Number of bytes read at once from an uploaded Synapses export
+READ_CHUNK_SIZE = 64 * 1024
+
+# Lecturers are named "SURNAME Firstname": the firstname is the last capitalized word
+USER_NAME_PATTERN = re.compile(r'(?P<surname>.+) (?P<firstname>\b[A-Z](?:(?![A-Z]).)+\b)')
+
 
 @bp.route("/update", methods=["GET", "POST"])
 @login_required
@@ -38,6 +67,9 @@ def update():
 		"heurefin" : "09:30:00",
 	}]
 
+    The file is saved and imported by a background worker (see tutorlink.jobs):
+    the page then polls the status of the import job.
+
     If the user is not an admin, abort with a 403 error.
     """
     if g.user.admin == False:
@@ -45,43 +77,74 @@ def update():
     if request.method == "POST":
         file = request.files.get("file", None)
         if file is not None:
-            sessions, session_types, modules, ue, users = read_json(file)
-            try:
-                result = populate_db(sessions, session_types, modules, ue, users)
-            except Exception as e:
-                flash(str(e), 'error')
+            job_id = submit_import(file)
+            job = jobs.get_job(job_id)
+            if job.status == 'done':
+                flash(job.message, 'success')
+            elif job.status == 'failed':
+                flash(job.message, 'error')
             else:
-                msg = f"Data updated: {', '.join(result)}"
-                flash(msg, 'success')
+                flash(f"Import of {file.filename} queued.", 'info')
         else:
             flash("No file selected", 'warning')
     
-    return render_template("data_update.html")
+    return render_template("data_update.html", job=jobs.get_job())
+
+@bp.route("/jobs/<int:job_id>", methods=["GET"])
+@login_required
+@admin_required
+def job_status(job_id):
+    """
+    Return the status, phase and row counts of an import job as JSON.
+
+    If the job does not exist, abort with a 404 error.
+    """
+    job = jobs.get_job(job_id)
+    if job is None:
+        abort(404)
+    return jsonify(jobs.job_to_dict(job))
 
-def parse_users(row: pd.Series) -> pd.Series:
+def submit_import(file):
     """
-    Parse the users from a row of the JSON file.
-    If the row is None, return None for all fields.
-    If the firstname or surname cannot be parsed,
-        return None for the surname and the unparsed name for the surname.
+    Save an uploaded Synapses export and enqueue its import.
 
     Parameters:
-        row (pd.Series): A row of one user from the JSON file. (e.g. {"NOM1 Prénom1":"username1"})
-    
+        file (FileStorage): The uploaded JSON file.
+
     Returns:
-        pd.Series: A Series containing the surname, firstname and username of the user.
+        int: The id of the import job.
     """
-    if row is None:
-        return pd.Series([None, None, None])
-    else:
-        name, username = next(iter(row.items()))
-        try:
-            # Parse firstname and surname
-            surname, firstname, _ = re.search(r'(.+) (\b[A-Z]((?![A-Z]).)+\b)', name).groups()
-        except AttributeError:
-            surname, firstname = name, ''
+    job_id = jobs.create_job(file.filename, g.user.username)
+    # The file is named after the job, so that a restart can delete it (see jobs.fail_stale_jobs)
+    path = jobs.job_path(job_id)
+    with open(path, 'wb') as f:
+        shutil.copyfileobj(file.stream, f)
+
+    jobs.submit(current_app._get_current_object(), run_import_job, job_id, path)
+    return job_id
 
-        return pd.Series([surname, firstname, username])
+def run_import_job(job_id, path):
+    """
+    Import a saved Synapses export and record the progress in its job.
+
+    The file is deleted once the import is over.
+
+    Parameters:
+        job_id (int): The id of the import job.
+        path (str): The path of the saved JSON file.
+    """
+    jobs.update_job(job_id, status='running', phase='reading')
+    try:
+        with open(path, 'rb') as file:
+            result = import_json(file, progress=functools.partial(jobs.update_job, job_id))
+    except Exception as e:
+        db_session.rollback()
+        jobs.update_job(job_id, status='failed', message=str(e))
+    else:
+        jobs.update_job(job_id, status='done', phase=None,
+                        message=f"Data updated: {', '.join(result)}")
+    finally:
+        os.remove(path)
 
 def read_json(path):
     """
@@ -100,26 +163,157 @@ def read_json(path):
     """
     df = pd.read_json(path, convert_dates=False)
 
+    return normalize_sessions(df)
+
+def read_json_batches(file, batch_size=BATCH_SIZE):
+    """
+    Read the JSON file incrementally and yield the data in batches of sessions.
+
+    Only one batch of sessions is held in memory at a time, whatever the size of the file.
+
+    Parameters:
+        file: The path to the JSON file or a binary file-like object.
+        batch_size (int): The maximum number of sessions in each batch.
+
+    Yields:
+        tuple: The same tuple as read_json, for each batch of sessions.
+    """
+    records = []
+    for record in iter_json_array(file):
+        records.append(record)
+        if len(records) == batch_size:
+            yield normalize_sessions(pd.DataFrame.from_records(records))
+            records = []
+    if records:
+        yield normalize_sessions(pd.DataFrame.from_records(records))
+
+def iter_json_array(file, chunk_size=READ_CHUNK_SIZE):
+    """
+    Yield the elements of the top-level JSON array of a file one by one.
+
+    The file is read by chunks of `chunk_size` bytes, and each element is
+    decoded as soon as it is complete.
+
+    Parameters:
+        file: The path to the JSON file or a binary file-like object.
+        chunk_size (int): The number of bytes read at once.
+
+    Raises:
+        ValueError: If the file is not a JSON array, or anything but blanks follows it.
+    """
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, 'rb') as stream:
+            yield from iter_json_array(stream, chunk_size)
+        return
+
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    buffer = ''
+    position = 0
+    # What may come next: '[', a value or ']', a value, ',' or ']', or only blanks
+    expected = '['
+    eof = False
+
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n':
+            position += 1
+
+        if position < len(buffer):
+            char = buffer[position]
+            if expected == '[':
+                if char != '[':
+                    raise ValueError("The JSON file must contain a list of sessions")
+                expected = 'value or ]'
+                position += 1
+                continue
+
+            if expected == 'end':
+                raise ValueError("Unexpected data after the list of sessions")
+
+            if expected == ', or ]':
+                if char not in ',]':
+                    raise ValueError("Expected ',' or ']' after a session")
+                expected = 'value' if char == ',' else 'end'
+                position += 1
+                continue
+
+            if char == ']' and expected == 'value or ]':
+                expected = 'end'
+                position += 1
+                continue
+
+            if char in ',]':
+                raise ValueError(f"Unexpected '{char}' in the list of sessions")
+
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                # An element is complete only if something follows it (',' or ']')
+                if end < len(buffer) or eof:
+                    yield element
+                    expected = ', or ]'
+                    position = end
+                    continue
+
+        if eof:
+            if expected == 'end':
+                return
+            raise ValueError("Unexpected end of the JSON file")
+
+        chunk = file.read(chunk_size)
+        eof = not chunk
+        if isinstance(chunk, bytes):
+            chunk = text_decoder.decode(chunk, final=eof)
+        buffer = buffer[position:] + chunk
+        position = 0
+
+def normalize_sessions(df: pd.DataFrame):
+    """
+    Normalize the raw sessions read from a Synapses export.
+
+    Parameters:
+        df (pd.DataFrame): The sessions as found in the JSON file.
+
+    Returns:
+        The same tuple as read_json.
+    """
+    df = df.reset_index(drop=True)
+
     df['date_start'] = pd.to_datetime(df['date'] + ' ' + df['heuredeb'])
     df['date_end'] = pd.to_datetime(df['date'] + ' ' + df['heurefin'])
 
     session_types = df[['type_synapses', 'libelle']].drop_duplicates()
-    session_types = {row['type_synapses']: row['libelle'] for _, row in session_types.iterrows()}
+    session_types = dict(zip(session_types['type_synapses'], session_types['libelle']))
 
     modules = df[['module', 'intitule_module']].drop_duplicates()
-    modules = {row['module']: row['intitule_module'] for _, row in modules.iterrows()}
+    modules = dict(zip(modules['module'], modules['intitule_module']))
 
     ue = df[['ue', 'intitule_ue']].drop_duplicates()
-    ue = {row['ue']: row['intitule_ue'] for _, row in ue.iterrows()}
+    ue = dict(zip(ue['ue'], ue['intitule_ue']))
 
-    users = df['intervenants'].explode().drop_duplicates().dropna()
-    users = users.apply(parse_users).rename(columns={0: 'surname', 1: 'firstname', 2: 'username'})
-    users.reset_index(drop=True, inplace=True)
+    # One row per (session, lecturer), indexed by the position of the session
+    lecturers = df['intervenants'].explode().dropna()
+    lecturers = pd.DataFrame([next(iter(user.items())) for user in lecturers],
+                             columns=['name', 'username'],
+                             index=lecturers.index)
 
-    df['intervenants'] = df['intervenants'].fillna('').apply(list)
-    df['intervenants'] = df['intervenants'].apply(lambda row: [next(iter(user.values())) for user in row])
+    users = lecturers.drop_duplicates().reset_index(drop=True)
+    names = users['name'].str.extract(USER_NAME_PATTERN)
+    users = pd.DataFrame({'surname': names['surname'].fillna(users['name']),
+                          'firstname': names['firstname'].fillna(''),
+                          'username': users['username']})
 
-    df['salles'] = df['salles'].apply(lambda row: ', '.join(row))
+    # The exploded rows are sorted by session: each session owns a contiguous slice
+    usernames = lecturers['username'].to_numpy()
+    positions = np.arange(len(df))
+    starts = np.searchsorted(lecturers.index.to_numpy(), positions, side='left')
+    ends = np.searchsorted(lecturers.index.to_numpy(), positions, side='right')
+    df['intervenants'] = [usernames[start:end].tolist() for start, end in zip(starts, ends)]
+
+    df['salles'] = df['salles'].str.join(', ')
 
     df = df[['id',
              'module',
@@ -133,6 +327,34 @@ def read_json(path):
 
     return df, session_types, modules, ue, users
 
+def import_json(file, batch_size=BATCH_SIZE, progress=None):
+    """
+    Import a Synapses JSON file into the database, one batch of sessions at a time.
+
+    Parameters:
+        file: The path to the JSON file or a binary file-like object.
+        batch_size (int): The number of sessions read and written at once.
+        progress (callable): If given, called after each step with the
+            keyword arguments `phase` and the counters of the importer.
+
+    Returns:
+        result: A list containing messages about the sessions added to the database.
+    """
+    importer = SynapsesImporter()
+    importer.import_roles()
+    for sessions, session_types, modules, ue, users in read_json_batches(file, batch_size):
+        importer.import_references(session_types, modules, ue, users)
+        importer.import_sessions(sessions)
+        if progress is not None:
+            progress(phase='importing', **importer.counts())
+
+    if progress is not None:
+        progress(phase='deleting', **importer.counts())
+    result = importer.finish()
+    if progress is not None:
+        progress(phase='committed', **importer.counts())
+    return result
+
 def populate_db(sessions: pd.DataFrame, session_types: dict, modules: dict, ue, users: pd.DataFrame):
     """
     Populate database with data from Synapses.
@@ -141,6 +363,9 @@ def populate_db(sessions: pd.DataFrame, session_types: dict, modules: dict, ue,
     Then, the SessionType, Module, UE and User tables are populated with the data from the JSON file.
     Finally, the Session table is populated with the data from the JSON file.
 
+    The work is done by a SynapsesImporter, which issues a few batched
+    statements per table instead of one query per row.
+
     Parameters:
         sessions (pd.DataFrame): The DataFrame containing the sessions from the JSON file.
         session_types (dict): A dict containing the session types and labels from the JSON file.
@@ -152,230 +377,303 @@ def populate_db(sessions: pd.DataFrame, session_types: dict, modules: dict, ue,
     Returns:
         result: A list containing messages about the sessions added to the database.
     """
-    
-    # Populate Role table
-    roles = {'Autre': -1,
-             'Professeur': 0,
-             'Doctorant': 1,
-             'Vacataire': 2}
-    
-    for name, id in roles.items():
-        role_in_db = db_session.execute(
-            select(Role)
-            .where(Role.name == name)
-            ).scalars().first()
-
-        if role_in_db is None:
-            role = Role(
-                name=name,
-                id=id
-            )
-            db_session.add(role)
+    importer = SynapsesImporter()
+    importer.import_roles()
+    importer.import_references(session_types, modules, ue, users)
+    importer.import_sessions(sessions)
+    return importer.finish()
 
-        else:
-            if role_in_db.id != id:
-                role_in_db.id = id
-                db_session.add(role_in_db)
-
-    # Populate SessionType table
-    for type, libele in session_types.items():
-        session_type_in_db = db_session.execute(
-            select(SessionType)
-            .where(SessionType.id == type)
-            ).scalars().first()
-
-        if session_type_in_db is None:
-            session_type = SessionType(
-                id=type,
-                name=libele
-            )
-            db_session.add(session_type)
 
-        else:
-            if session_type_in_db.name != libele:
-                session_type_in_db.name = libele
-                db_session.add(session_type_in_db)
+def session_fingerprint(row: dict) -> str:
+    """
+    Return a hash of the Synapses content of a session.
 
-    # Populate Module table
-    for module_name, module_label in modules.items():
+    Two imports of the same session give the same fingerprint as long as its
+    module, UE, groups, type, rooms, dates and lecturers are the same.
 
-        module_in_db = db_session.execute(
-            select(Module)
-            .where(Module.name == module_name)
-            ).scalars().first()
+    Parameters:
+        row (dict): A session, as a row of the DataFrame returned by read_json.
+    """
+    content = '\x1f'.join([str(row['module']),
+                           str(row['ue']),
+                           str(row['groupes']),
+                           str(row['type_synapses']),
+                           str(row['salles']),
+                           row['date_start'].isoformat(),
+                           row['date_end'].isoformat(),
+                           *sorted(row['intervenants'])])
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
 
-        if module_in_db is None:
-            module = Module(
-                name=module_name,
-                label=module_label
-            )
-            db_session.add(module)
+def batched(rows, size=BATCH_SIZE):
+    """Yield successive slices of at most `size` elements of the list `rows`."""
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
 
-        else:
-            if module_in_db.label != module_label:
-                module_in_db.label = module_label
-                db_session.add(module_in_db)
-
-    # Populate UE table
-    for ue_name, ue_label in ue.items():
-        ue_in_db = db_session.execute(
-            select(Ue)
-            .where(Ue.name == ue_name)
-            ).scalars().first()
-
-        if ue_in_db is None:
-            ue = Ue(
-                name=ue_name,
-                label=ue_label
-            )
-            db_session.add(ue)
 
-        else:
-            if ue_in_db.label != ue_label:
-                ue_in_db.label = ue_label
-                db_session.add(ue_in_db)
-    
-    # Populate User table
-    for _, user in users.iterrows():
-        user_in_db = db_session.execute(
-            select(User)
-            .where(User.username == user['username'])
-            ).scalars().first()
-
-        if user_in_db is None:
-            user = User(
-                surname=user['surname'],
-                name=user['firstname'],
-                username=user['username']
-            )
-            db_session.add(user)
-
-    # Populate Session table
-    
-    # Computing session ids to add, update and delete
-    sessions_id_in_db = db_session.execute(select(Session.id)).scalars().all()
-
-    db_ids = set(sessions_id_in_db)
-    new_ids = set(sessions['id'])
-
-    ids_to_add = new_ids - db_ids
-    ids_to_update = new_ids & db_ids
-    ids_to_delete = db_ids - new_ids
-
-    # Add new sessions
-    new = 0
-    for _, row in sessions.loc[sessions['id'].isin(ids_to_add)].iterrows():
-        new += 1
-        session = Session(
-            id=row['id'],
-            module=db_session.execute(
-                        select(Module)
-                        .where(Module.name == row['module'])
-                        ).scalars().first(),
-            ue=db_session.execute(
-                        select(Ue)
-                        .where(Ue.name == row['ue'])
-                        ).scalars().first(),
-            group_name=row['groupes'],
-            type=row['type_synapses'],
-            salle=row['salles'],
-            date_start=row['date_start'],
-            date_end=row['date_end']
-        )
-        db_session.add(session)
-
-        for user in row['intervenants']:
-            lecturer = LecturedBy(session_id=row['id'],
-                                user_username=user,
-                                synapse=True)
-            db_session.add(lecturer)
-    
-    # Update existing sessions
-    modified = 0
-    not_changed = 0
-    for _, row in sessions.loc[sessions['id'].isin(ids_to_update)].iterrows():
-
-        session = db_session.execute(
-            select(Session)
-            .where(Session.id == row['id'])
-            ).scalars().first()
-        
-        message = ""
-
-        if session.module.name != row['module']:
-            message += f"Session {row['id']} has changed module from {session.module.name} to {row['module']}. "
-            session.module = db_session.execute(
-                select(Module)
-                .where(Module.name == row['module'])
-                ).scalars().first()
-
-        if session.ue.name != row['ue']:
-            message += f"Session {row['id']} has changed UE from {session.ue.name} to {row['ue']}. "
-            session.ue = db_session.execute(
-                select(Ue)
-                .where(Ue.name == row['ue'])
-                ).scalars().first()
-
-        if session.group_name != row['groupes']:
-            message += f"Session {row['id']} has changed group from {session.group_name} to {row['groupes']}. "
-            session.group_name = row['groupes']
-
-        if session.type != row['type_synapses']:
-            message += f"Session {row['id']} has changed type from {session.type} to {row['type_synapses']}. "
-            session.type = row['type_synapses']
-
-        if session.salle != row['salles']:
-            message += f"Session {row['id']} has changed salle from {session.salle} to {row['salles']}. "
-            session.salle = row['salles']
-
-        if session.date_start != row['date_start']:
-            message += f"Session {row['id']} has changed start date from {session.date_start} to {row['date_start']}. "
-            session.date_start = row['date_start']
-
-        if session.date_end != row['date_end']:
-            message += f"Session {row['id']} has changed end date from {session.date_end} to {row['date_end']}. "
-            session.date_end = row['date_end']
-        
-        if message != "":
-            db_session.add(session)
-            
-        for user in row['intervenants']:
-            lecturer_in_db = db_session.execute(
-                                select(LecturedBy)
-                                .where(LecturedBy.session_id == row['id'])
-                                .where(LecturedBy.user_username == user)
-                                ).scalars().first()
-
-            if lecturer_in_db is None:
-                lecturer = LecturedBy(session_id=row['id'],
-                                    user_username=user,
-                                    synapse=True)
-                db_session.add(lecturer)
-                message += f"Session {row['id']} has new lecturer {user}. "
+def any_of(values, type_=Integer):
+    """Return an `= ANY(:array)` operand, so that a list of keys is sent as one parameter."""
+    return any_(literal(list(values), ARRAY(type_)))
+
 
+class SynapsesImporter:
+    """
+    Bulk import engine for the Synapses sessions.
+
+    The reference tables (roles, session types, modules, UE) are loaded once
+    into in-memory key => id maps. Sessions are then compared batch by batch
+    against the database and written with multi-row INSERT ... ON CONFLICT,
+    executemany UPDATE and set-based DELETE ... WHERE id = ANY(...) statements.
+
+    Each session row stores the fingerprint of its Synapses content (see
+    session_fingerprint): the unchanged sessions of a re-import cost a single
+    hash comparison and no write.
+
+    Nothing is committed before finish() is called. The imports are
+    serialized by a PostgreSQL advisory lock, held until then.
+    """
+
+    def __init__(self):
+        # One import at a time, whatever the worker: the transaction lock is
+        # released by the commit of finish() (or by a rollback)
+        db_session.execute(select(func.pg_advisory_xact_lock(jobs.IMPORT_LOCK_KEY)))
+
+        module_table = Module.__table__
+        ue_table = Ue.__table__
+
+        # Modules and UEs are referenced by name in Synapses and by id in the database
+        self.modules = {row.name: (row.id, row.label) for row in db_session.execute(
+            select(module_table.c.name, module_table.c.id, module_table.c.label))}
+        self.ues = {row.name: (row.id, row.label) for row in db_session.execute(
+            select(ue_table.c.name, ue_table.c.id, ue_table.c.label))}
+
+        # Ids of the sessions found in the imported file
+        self.seen_ids = set()
+        # Usernames already inserted by a previous batch
+        self.seen_usernames = set()
+        # Lecturers of the new, modified and deleted sessions, whose calendars are outdated
+        self.touched_usernames = set()
+        # True if a session type, module or UE was inserted or renamed
+        self.references_changed = False
+
+        self.new = 0
+        self.modified = 0
+        self.not_changed = 0
+        self.deleted = 0
+
+    def import_roles(self):
+        """Insert or update the roles declared in ROLES."""
+        role_table = Role.__table__
+        stmt = pg_insert(role_table).values([{'id': id, 'name': name} for name, id in ROLES.items()])
+        db_session.execute(stmt.on_conflict_do_update(
+            index_elements=[role_table.c.id],
+            set_={'name': stmt.excluded.name},
+            where=role_table.c.name != stmt.excluded.name))
+
+    def import_references(self, session_types: dict, modules: dict, ue: dict, users: pd.DataFrame):
+        """
+        Insert or update the session types, modules, UE and users.
+
+        Parameters:
+            session_types (dict): The session types and labels.
+            modules (dict): The modules names and labels.
+            ue (dict): The UE names and labels.
+            users (pd.DataFrame): The users surname, firstname and username.
+        """
+        session_type_table = SessionType.__table__
+        rows = [{'id': type, 'name': libelle} for type, libelle in session_types.items()]
+        for batch in batched(rows):
+            stmt = pg_insert(session_type_table).values(batch)
+            upserted = db_session.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=[session_type_table.c.id],
+                    set_={'name': stmt.excluded.name},
+                    where=session_type_table.c.name != stmt.excluded.name)
+                .returning(session_type_table.c.id)).first()
+            if upserted is not None:
+                self.references_changed = True
+
+        self._import_labels(Module.__table__, self.modules, modules)
+        self._import_labels(Ue.__table__, self.ues, ue)
+
+        user_table = User.__table__
+        rows = [{'username': user['username'],
+                 'surname': user['surname'],
+                 'name': user['firstname']}
+                for user in users.to_dict('records')
+                if user['username'] not in self.seen_usernames]
+        self.seen_usernames.update(row['username'] for row in rows)
+        for batch in batched(rows):
+            db_session.execute(pg_insert(user_table)
+                               .values(batch)
+                               .on_conflict_do_nothing(index_elements=[user_table.c.username]))
+
+    def _import_labels(self, table, known: dict, labels: dict):
+        """Insert the missing names of a module-like table and update the changed labels."""
+        rows = [{'name': name, 'label': label}
+                for name, label in labels.items()
+                if name not in known or known[name][1] != label]
+
+        # The names are unique: new names are inserted, known ones get their new label
+        for batch in batched(rows):
+            stmt = pg_insert(table).values(batch)
+            upserted = db_session.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=[table.c.name],
+                    set_={'label': stmt.excluded.label},
+                    where=table.c.label != stmt.excluded.label)
+                .returning(table.c.name, table.c.id, table.c.label)).all()
+            known.update({row.name: (row.id, row.label) for row in upserted})
+            if upserted:
+                self.references_changed = True
+
+    def import_sessions(self, sessions: pd.DataFrame):
+        """
+        Insert the new sessions, update the modified ones and confirm their lecturers.
+
+        Parameters:
+            sessions (pd.DataFrame): The sessions, as returned by read_json.
+        """
+        for batch in batched(sessions.to_dict('records')):
+            self._import_session_batch(batch)
+
+    def _import_session_batch(self, batch: list):
+        """
+        Compare one batch of sessions with the database and write the differences.
+
+        The sessions whose fingerprint is the same as in the database are
+        skipped without further comparison.
+        """
+        session_table = Session.__table__
+        lectured_by_table = LecturedBy.__table__
+
+        ids = [row['id'] for row in batch]
+        self.seen_ids.update(ids)
+
+        fingerprints_in_db = dict(db_session.execute(
+            select(session_table.c.id, session_table.c.fingerprint)
+            .where(session_table.c.id == any_of(ids))).all())
+
+        changed_rows = []
+        for row in batch:
+            row['fingerprint'] = session_fingerprint(row)
+            if (row['id'] in fingerprints_in_db
+                and fingerprints_in_db[row['id']] == row['fingerprint']):
+                self.not_changed += 1
             else:
-                lecturer_in_db.synapse = True
-                db_session.add(lecturer_in_db)
-        
-        if message != "":
-            modified += 1
-        else:
-            not_changed += 1
-
-    # Delete sessions
-    deleted = 0
-    for session_id in ids_to_delete:
-        session = db_session.execute(
-            select(Session)
-            .where(Session.id == session_id)
-            ).scalars().first()
-
-        db_session.delete(session)
-        deleted += 1
-
-    db_session.commit()
-    result = [f'{new} new sessions', 
-              f'{modified} modified sessions', 
-              f'{not_changed} not changed sessions',
-              f'{deleted} deleted sessions']
-    return result
+                changed_rows.append(row)
+
+        if not changed_rows:
+            return
+
+        # Only the sessions whose content differs are loaded and compared column by column
+        changed_ids = [row['id'] for row in changed_rows if row['id'] in fingerprints_in_db]
+        in_db = {row.id: row for row in db_session.execute(
+            select(session_table).where(session_table.c.id == any_of(changed_ids)))}
+        lecturers_in_db = {(row.session_id, row.user_username): row.synapse
+                           for row in db_session.execute(
+                                select(lectured_by_table)
+                                .where(lectured_by_table.c.session_id == any_of(changed_ids)))}
+        self.touched_usernames.update(username for _, username in lecturers_in_db)
+
+        to_insert = []
+        to_update = []
+        lecturers = []
+        for row in changed_rows:
+            values = {
+                'module_id': self.modules[row['module']][0],
+                'ue_id': self.ues[row['ue']][0],
+                'group_name': row['groupes'],
+                'type': row['type_synapses'],
+                'salle': row['salles'],
+                'date_start': row['date_start'],
+                'date_end': row['date_end'],
+            }
+            pairs = {(row['id'], user) for user in row['intervenants']}
+            self.touched_usernames.update(row['intervenants'])
+            new_lecturers = pairs - lecturers_in_db.keys()
+            # New lecturers, and lecturers registered by hand now confirmed by Synapses
+            lecturers.extend(pair for pair in pairs if lecturers_in_db.get(pair) is not True)
+
+            session = in_db.get(row['id'])
+            if session is None:
+                to_insert.append({'id': row['id'], 'fingerprint': row['fingerprint'], **values})
+                self.new += 1
+            else:
+                changed = any(getattr(session, column) != value for column, value in values.items())
+                to_update.append({'b_id': row['id'], 'fingerprint': row['fingerprint'], **values})
+                if changed or new_lecturers:
+                    self.modified += 1
+                else:
+                    self.not_changed += 1
+
+        if to_insert:
+            db_session.execute(session_table.insert().values(to_insert))
+
+        if to_update:
+            db_session.execute(
+                session_table.update().where(session_table.c.id == bindparam('b_id')),
+                to_update)
+
+        if lecturers:
+            stmt = pg_insert(lectured_by_table).values([
+                {'session_id': session_id, 'user_username': username, 'synapse': True}
+                for session_id, username in sorted(set(lecturers))])
+            db_session.execute(stmt.on_conflict_do_update(
+                index_elements=[lectured_by_table.c.session_id, lectured_by_table.c.user_username],
+                set_={'synapse': True}))
+
+    def counts(self):
+        """Return the counters of the import, named as the columns of the import_job table."""
+        return {'sessions_read': len(self.seen_ids),
+                'new_sessions': self.new,
+                'modified_sessions': self.modified,
+                'not_changed_sessions': self.not_changed,
+                'deleted_sessions': self.deleted}
+
+    def finish(self):
+        """
+        Delete the sessions absent from the imported file, commit and invalidate the caches.
+
+        Only the caches of the data which changed are bumped: an import
+        which changes nothing keeps the cached pages, cards and feeds.
+
+        Returns:
+            result: A list containing messages about the sessions added to the database.
+        """
+        session_table = Session.__table__
+        lectured_by_table = LecturedBy.__table__
+
+        db_ids = set(db_session.execute(select(session_table.c.id)).scalars())
+        ids_to_delete = sorted(db_ids - self.seen_ids)
+
+        for batch in batched(ids_to_delete):
+            self.touched_usernames.update(db_session.execute(
+                lectured_by_table.delete()
+                .where(lectured_by_table.c.session_id == any_of(batch))
+                .returning(lectured_by_table.c.user_username)).scalars())
+            db_session.execute(
+                session_table.delete()
+                .where(session_table.c.id == any_of(batch)))
+        self.deleted = len(ids_to_delete)
+
+        if self.references_changed:
+            # The labels of the modules, UE and types are in every feed
+            self.touched_usernames.update(db_session.execute(
+                select(lectured_by_table.c.user_username).distinct()).scalars())
+
+        db_session.commit()
+        sessions_changed = self.new + self.modified + self.deleted > 0
+        if sessions_changed:
+            cache.open_sessions.invalidate()
+        if self.references_changed:
+            cache.reference_data.bump()
+        if sessions_changed or self.references_changed:
+            cache.session_cards.bump()
+            cache.data.bump()
+        for username in self.touched_usernames:
+            cache.calendars.bump(username)
+        result = [f'{self.new} new sessions', 
+                  f'{self.modified} modified sessions', 
+                  f'{self.not_changed} not changed sessions',
+                  f'{self.deleted} deleted sessions']
+        return result
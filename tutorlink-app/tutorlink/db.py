@@ -1,21 +1,40 @@
+import functools
+import hashlib
+import os
+import pickle
+import tempfile
+import time
 import click
 import sqlalchemy
 from sqlalchemy import create_engine
 from sqlalchemy import MetaData
 from sqlalchemy import select
+from sqlalchemy import text
+from sqlalchemy.sql.dml import UpdateBase
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm import relationship
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import selectinload
 from sqlalchemy.ext.automap import automap_base
 from sqlalchemy.ext.automap import name_for_collection_relationship
 from sqlalchemy.ext.automap import name_for_scalar_relationship
+from flask import current_app
+from flask import g
+from flask import has_app_context
+from flask import has_request_context
+from flask import session as flask_session
 from flask.cli import with_appcontext
 from flask_sqlalchemy_session import flask_scoped_session
 
+from tutorlink import metrics
+
 # from sqlalchemy.orm import scoped_session
 
 # Les éléments suivants seront définis lorsque l'automap aura fait son
 # travail...
 db_session = None
+engine = None
+replica_engine = None
 
 User = None
 Session = None
@@ -26,6 +45,28 @@ Favorite = None
 ManagedBy = None
 LecturedBy = None
 SessionType = None
+ImportJob = None
+
+# Clé de la session Flask : date jusqu'à laquelle l'utilisateur lit sur le primaire
+PRIMARY_UNTIL_KEY = 'db_primary_until'
+
+# Classes du modèle déjà créées, par version du schéma (voir schema_key)
+_mapped_models = {}
+
+
+# ORM: correpondances nom de table => nom de classe
+MODEL_MAP = {
+    'user': 'User',
+    'session': 'Session',
+    'module': 'Module',
+    'ue': 'Ue',
+    'role': 'Role',
+    'favorite': 'Favorite',
+    'managed_by': 'ManagedBy',
+    'lectured_by': 'LecturedBy',
+    'session_type': 'SessionType',
+    'import_job': 'ImportJob',
+}
 
 
 def connect_db(app):
@@ -34,21 +75,200 @@ def connect_db(app):
     if app.config['TRACE_MAPPING']:
         click.echo("DB mapping...")
 
+    url_de_connexion = app.config['SQLALCHEMY_DATABASE_URI']
+    sqlalchemy_engine_echo = app.config['SQLALCHEMY_ENGINE_ECHO']
+
+    if app.config['TRACE_MAPPING']:
+        click.echo("URL de connexion:" + url_de_connexion)
+
+    engine = create_engine(
+        url_de_connexion,
+        # si True, pratique pour déboguer (mais très verbeux)
+        echo=sqlalchemy_engine_echo,
+        # pour disposer des fonctionnalités de la version 2.0
+        future=True,
+        **pool_options(app.config),
+    )
+    app.extensions['pool_metrics'] = metrics.instrument_engine(engine)
+
+    # Réplique en lecture seule (streaming replication) utilisée par les vues
+    # @read_only ; sans réplique, toutes les requêtes vont au primaire
+    replica_engine = engine
+    if app.config.get('SQLALCHEMY_REPLICA_URI'):
+        replica_engine = create_engine(
+            app.config['SQLALCHEMY_REPLICA_URI'],
+            echo=sqlalchemy_engine_echo,
+            future=True,
+            **pool_options(app.config),
+        )
+        app.extensions['replica_pool_metrics'] = metrics.instrument_engine(replica_engine)
+
+    # Le mapping ne dépend que du schéma : il est fait une seule fois par
+    # processus et par version du schéma, à partir des métadonnées conservées
+    # dans le répertoire instance (sans interroger le catalogue de la base)
+    key = schema_key(app, engine)
+    models = _mapped_models.get(key) if key is not None else None
+    if models is None:
+        models = map_models(app, load_metadata(app, engine, key))
+        if key is not None:
+            _mapped_models[key] = models
+
+    # On rend les tables du modèle globales à ce module (None pour les tables
+    # qui n'existent pas encore, avant "flask db-migrate")
+    mapped = {cls.__name__: cls for cls in models}
+    for name in MODEL_MAP.values():
+        globals()[name] = mapped.get(name)
+    for cls in models:
+        cls.__table__.info = dict(bind_key='main')
+    globals()['engine'] = engine
+    globals()['replica_engine'] = replica_engine
+
+    Session = sessionmaker(
+        bind=engine,
+        future=True,
+        class_=RoutingSession,
+        info={'primary': engine, 'replica': replica_engine},
+    )
+    globals()['db_session'] = flask_scoped_session(Session, app)
+
+    if app.config['TRACE_MAPPING']:
+        click.echo("DB mapping done.")
 
-    # ORM: correpondances nom de table => nom de classe
-    model_map = {
-        'user': 'User',
-        'session': 'Session',
-        'module': 'Module',
-        'ue': 'Ue',
-        'role': 'Role',
-        'favorite': 'Favorite',
-        'managed_by': 'ManagedBy',
-        'lectured_by': 'LecturedBy',
-        'session_type': 'SessionType',
+class RoutingSession(sqlalchemy.orm.Session):
+    """
+    Session which sends the reads of the @read_only views to the replica.
+
+    The flushes and the INSERT / UPDATE / DELETE statements always go to the
+    primary, and mark the request as a write (see mark_primary_sticky).
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self._flushing or isinstance(clause, UpdateBase):
+            if has_request_context():
+                g.db_wrote = True
+            return self.info['primary']
+        if has_app_context() and g.get('db_read_only', False):
+            return self.info['replica']
+        return self.info['primary']
+
+
+def read_only(function):
+    """
+    Serve the reads of a view from the replica.
+
+    After a write, the user is served by the primary for
+    REPLICA_STICKY_SECONDS, so that they always see their own changes even
+    if the replica lags behind.
+    """
+    @functools.wraps(function)
+    def wrap(*args, **kwargs):
+        g.db_read_only = flask_session.get(PRIMARY_UNTIL_KEY, 0) <= time.time()
+        return function(*args, **kwargs)
+    return wrap
+
+
+def mark_primary_sticky(response):
+    """After a request which wrote to the primary, keep the user on the primary for a while."""
+    if g.get('db_wrote', False):
+        flask_session[PRIMARY_UNTIL_KEY] = time.time() + current_app.config.get('REPLICA_STICKY_SECONDS', 10)
+    return response
+
+
+def pool_options(config):
+    """
+    Return the options of the connection pool of the engine, from the configuration.
+
+    SQLALCHEMY_NULL_POOL = True opens a new connection for each checkout,
+    e.g. behind PgBouncer which pools the connections itself. Otherwise a
+    QueuePool is configured with SQLALCHEMY_POOL_SIZE, SQLALCHEMY_MAX_OVERFLOW,
+    SQLALCHEMY_POOL_TIMEOUT, SQLALCHEMY_POOL_RECYCLE and SQLALCHEMY_POOL_PRE_PING.
+
+    Returns:
+        dict: The keyword arguments of create_engine.
+    """
+    if config.get('SQLALCHEMY_NULL_POOL', False):
+        return {'poolclass': metrics.TimedNullPool}
+
+    return {
+        'poolclass': metrics.TimedQueuePool,
+        'pool_size': config.get('SQLALCHEMY_POOL_SIZE', 5),
+        'max_overflow': config.get('SQLALCHEMY_MAX_OVERFLOW', 10),
+        'pool_timeout': config.get('SQLALCHEMY_POOL_TIMEOUT', 30),
+        'pool_recycle': config.get('SQLALCHEMY_POOL_RECYCLE', -1),
+        'pool_pre_ping': config.get('SQLALCHEMY_POOL_PRE_PING', False),
     }
 
 
+def schema_key(app, engine):
+    """
+    Return a hash of sql/schema.sql and of the migrations applied to the database.
+
+    The tables of the database only change when it is created again from
+    schema.sql or when "flask db-migrate" records a migration in
+    schema_migration, so the hash identifies the cached metadata. A
+    database without recorded migrations (created before schema_migration
+    existed) cannot be identified: None is returned and it is always reflected.
+    """
+    with engine.connect() as connection:
+        if connection.execute(text("select to_regclass('schema_migration')")).scalar() is None:
+            return None
+        applied = connection.execute(text("select name from schema_migration order by name")).scalars().all()
+    if not applied:
+        return None
+
+    digest = hashlib.blake2b(digest_size=16)
+    with open(app.config['SCHEMA_FILE'], 'rb') as file:
+        digest.update(file.read())
+    for name in applied:
+        digest.update(b'\0' + name.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def load_metadata(app, engine, key):
+    """
+    Return the metadata of the tables of MODEL_MAP which exist in the database.
+
+    The metadata is read from the pickle of the instance folder named after
+    `key` if it exists, otherwise it is reflected from the database and
+    saved there. METADATA_CACHE = False, or a None key, always reflects the database.
+
+    Parameters:
+        app (Flask): The application.
+        engine (Engine): The engine used for the reflection.
+        key (str): The version of the schema, see schema_key.
+
+    Returns:
+        MetaData: The metadata of the tables.
+    """
+    use_cache = app.config.get('METADATA_CACHE', True) and key is not None
+    path = os.path.join(app.instance_path, f"metadata-{key}.pickle")
+
+    if use_cache and os.path.exists(path):
+        with open(path, 'rb') as file:
+            return pickle.load(file)
+
+    # The tables added by the migrations are missing until "flask db-migrate" runs
+    our_metadata = MetaData()
+    our_metadata.reflect(engine, only=lambda name, metadata: name in MODEL_MAP)
+
+    if use_cache:
+        # Written in a temporary file first, so that a concurrent worker never
+        # reads a partial pickle
+        os.makedirs(app.instance_path, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=app.instance_path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as file:
+            pickle.dump(our_metadata, file)
+        os.replace(tmp_path, path)
+    return our_metadata
+
+
+def map_models(app, our_metadata):
+    """
+    Create the classes of the model from the metadata with the automap.
+
+    Returns:
+        list: The mapped classes.
+    """
     relation_map = {
         'User=>Role(user_role_id_fkey)': 'role',
         'Role=>User(user_role_id_fkey)': 'all_users',
@@ -85,22 +305,6 @@ def connect_db(app):
         'User=>Session(lectured_by_user_username_fkey)': 'lectured_sessions',
     }
 
-    url_de_connexion = app.config['SQLALCHEMY_DATABASE_URI']
-    sqlalchemy_engine_echo = app.config['SQLALCHEMY_ENGINE_ECHO']
-
-    if app.config['TRACE_MAPPING']:
-        click.echo("URL de connexion:" + url_de_connexion)
-
-    engine = create_engine(
-        url_de_connexion,
-        # si True, pratique pour déboguer (mais très verbeux)
-        echo=sqlalchemy_engine_echo,
-        # pour disposer des fonctionnalités de la version 2.0
-        future=True,
-    )
-    our_metadata = MetaData()
-    our_metadata.reflect(engine, only=model_map.keys())
-    # print("our_metadata: ok")
     Base = automap_base(metadata=our_metadata)
 
 
@@ -174,6 +378,16 @@ def connect_db(app):
             return f"Role({self.id}, {self.name})"
 
 
+    ImportJob = None
+    # Added by the migration 0001_import_job.sql
+    if 'import_job' in our_metadata.tables:
+        class ImportJob(Base):
+            __tablename__ = 'import_job'
+
+            def __str__(self):
+                return f"ImportJob({self.id}, {self.status}, {self.phase})"
+
+
     def map_names(type, orig_func):
         """fonction d'aide à la mise en correspondance"""
 
@@ -201,20 +415,31 @@ def connect_db(app):
                                                    name_for_collection_relationship),
     )
 
-    # On rend les tables du modèle globales à ce module
-    for cls in [User, Session, Module, Ue, Role, Favorite, ManagedBy, LecturedBy, SessionType]:
-        cls.__table__.info = dict(bind_key='main')
-        globals()[cls.__name__] = cls
+    return [cls for cls in (User, Session, Module, Ue, Role, Favorite, ManagedBy, LecturedBy, SessionType, ImportJob)
+            if cls is not None]
 
-    Session = sessionmaker(
-        bind=engine,
-        future=True,
-        class_=sqlalchemy.orm.Session
-    )
-    globals()['db_session'] = flask_scoped_session(Session, app)
 
-    if app.config['TRACE_MAPPING']:
-        click.echo("DB mapping done.")
+def session_card_options(session_cls):
+    """
+    Return the loader options needed to render session cards.
+
+    The cards show the module, the UE, the type and the lecturers of each
+    session: they are loaded with the sessions instead of lazily, so that a
+    page of cards costs a constant number of queries.
+
+    Parameters:
+        session_cls (class): The mapped Session class used in the query.
+
+    Returns:
+        list: The options to give to `select(...).options(...)`.
+    """
+    return [
+        joinedload(session_cls.module),
+        joinedload(session_cls.ue),
+        joinedload(session_cls.session_type),
+        selectinload(session_cls.lectured_by_users),
+    ]
+
 
 @click.command("check-db")
 @with_appcontext
@@ -231,6 +456,68 @@ def check_db_command():
         assert isinstance(user, User)
 
 
+def pending_migrations(connection, directory):
+    """
+    Return the migrations of `directory` not yet recorded in schema_migration.
+
+    Parameters:
+        connection (Connection): An open connection to the database.
+        directory (str): The directory of the migration files.
+
+    Returns:
+        list: The file names of the pending migrations, in the order of their number.
+    """
+    connection.execute(text(
+        "create table if not exists schema_migration ("
+        " name text primary key,"
+        " applied_at timestamp not null default now())"))
+    applied = set(connection.execute(text("select name from schema_migration")).scalars())
+    return sorted(name for name in os.listdir(directory)
+                  if name.endswith('.sql') and name not in applied)
+
+
+def apply_migrations(engine, directory):
+    """
+    Apply the pending migrations, each one in its own transaction.
+
+    Parameters:
+        engine (Engine): The engine of the database to migrate.
+        directory (str): The directory of the migration files.
+
+    Returns:
+        list: The file names of the applied migrations.
+    """
+    with engine.begin() as connection:
+        names = pending_migrations(connection, directory)
+
+    for name in names:
+        with open(os.path.join(directory, name), encoding='utf-8') as file:
+            script = file.read()
+        with engine.begin() as connection:
+            connection.exec_driver_sql(script)
+            connection.execute(text("insert into schema_migration (name) values (:name)"),
+                               {'name': name})
+    return names
+
+
+@click.command("db-migrate")
+@click.option('--dry-run', is_flag=True, help="Only list the pending migrations.")
+@with_appcontext
+def db_migrate_command(dry_run):
+    """Applique les migrations de sql/migrations qui ne l'ont pas encore été."""
+    directory = current_app.config['MIGRATIONS_DIR']
+    if dry_run:
+        with engine.begin() as connection:
+            names = pending_migrations(connection, directory)
+    else:
+        names = apply_migrations(engine, directory)
+
+    for name in names:
+        click.echo(f"{'pending' if dry_run else 'applied'}: {name}")
+    if not names:
+        click.echo("The database is up to date.")
+
+
 def init_app(app):
     """Initialisation du lien avec la base de données"""
 
@@ -239,6 +526,13 @@ def init_app(app):
             f"SQLALCHEMY_DATABASE_URI: {app.config['SQLALCHEMY_DATABASE_URI']}"
         )
 
+    app.config.setdefault('SCHEMA_FILE',
+                          os.path.join(os.path.dirname(app.root_path), 'sql', 'schema.sql'))
+    app.config.setdefault('MIGRATIONS_DIR',
+                          os.path.join(os.path.dirname(app.root_path), 'sql', 'migrations'))
+
     connect_db(app)
+    app.after_request(mark_primary_sticky)
 
     app.cli.add_command(check_db_command)
+    app.cli.add_command(db_migrate_command)
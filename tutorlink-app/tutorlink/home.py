@@ -1,10 +1,12 @@
-from flask import Blueprint, render_template, g
-from sqlalchemy import select
+from flask import Blueprint, render_template, g, current_app
+from sqlalchemy import select, func, exists
 
 import datetime
 
+from tutorlink import cache
 from tutorlink.auth import login_required
-from tutorlink.db import db_session, Session, LecturedBy
+from tutorlink.db import db_session, Session, LecturedBy, session_card_options, read_only
+from tutorlink.session import lectured_session_ids
 
 
 bp = Blueprint("home", __name__)
@@ -12,6 +14,8 @@ bp = Blueprint("home", __name__)
 
 @bp.route("/")
 @login_required
+@cache.conditional
+@read_only
 def index():
     """
     Show the main page of the application
@@ -26,21 +30,22 @@ def index():
     # Fetch the list of urgent sessions i.e. sessions without lecturers
     urgent_sessions = db_session.execute(
         select(Session)
-        .join(LecturedBy, Session.id == LecturedBy.session_id, isouter=True)
-        .where(LecturedBy.user_username == None)
-        .where(Session.date_start >= datetime.datetime.now())
-        .order_by(Session.date_start)
+        .options(*session_card_options(Session))
+        .where(*open_session_criteria())
+        .order_by(Session.date_start, Session.id)
         .limit(12)
         ).scalars().all()
 
-    all_user_sessions = db_session.execute(
-        select(Session)
+    # Total duration of the sessions lectured by the user, summed by the database
+    total_duration = db_session.execute(
+        select(func.sum(Session.date_end - Session.date_start))
         .join(LecturedBy, Session.id == LecturedBy.session_id)
         .where(LecturedBy.user_username == g.user.username)
-        ).scalars()
+        ).scalar() or datetime.timedelta()
 
     user_next_sessions = db_session.execute(
         select(Session)
+        .options(*session_card_options(Session))
         .join(LecturedBy, Session.id == LecturedBy.session_id)
         .where(LecturedBy.user_username == g.user.username)
         .where(Session.date_start >= datetime.datetime.now())
@@ -48,9 +53,39 @@ def index():
         .limit(12)
         ).scalars().all()
 
-    total_duration = sum([session.duration for session in all_user_sessions], datetime.timedelta())
-    
     return render_template("home/index.html",
                             urgent_sessions=urgent_sessions,
                             user_next_sessions=user_next_sessions,
-                            total_duration=round(total_duration.total_seconds()/3600, 2))
+                            lectured_ids=lectured_session_ids(g.user.username, urgent_sessions + user_next_sessions),
+                            total_duration=round(total_duration.total_seconds()/3600, 2),
+                            nb_open_sessions=count_open_sessions())
+
+
+def open_session_criteria():
+    """
+    Return the criteria of the open sessions i.e. upcoming sessions without lecturers.
+
+    The sessions without lecturers are found with a NOT EXISTS anti-join,
+    which uses the primary key of lectured_by, and the upcoming ones with
+    the (date_start, id) index of session.
+    """
+    return [
+        ~exists().where(LecturedBy.session_id == Session.id),
+        Session.date_start >= datetime.datetime.now(),
+    ]
+
+
+def count_open_sessions():
+    """
+    Return the number of open sessions.
+
+    The count is cached for OPEN_SESSIONS_CACHE_TTL seconds, and reset when
+    a registration or an import changes the lecturers of the sessions.
+    """
+    return cache.open_sessions.get_or_set(
+        'count',
+        lambda: db_session.execute(
+            select(func.count(Session.id))
+            .where(*open_session_criteria())
+            ).scalar(),
+        ttl=current_app.config.get('OPEN_SESSIONS_CACHE_TTL'))
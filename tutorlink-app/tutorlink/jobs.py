@@ -0,0 +1,165 @@
+import datetime
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import func, select
+
+from tutorlink import db
+from tutorlink.db import db_session, ImportJob
+
+# Key of the PostgreSQL advisory lock held by the running import (see
+# SynapsesImporter): the imports of all the workers run one at a time
+IMPORT_LOCK_KEY = 0x74757469
+
+
+def job_path(job_id):
+    """Return the path of the uploaded file of an import job, until it is imported."""
+    return os.path.join(tempfile.gettempdir(), f"synapses-job-{job_id}.json")
+
+
+def create_job(filename, username):
+    """
+    Create a queued import job in the database.
+
+    Parameters:
+        filename (str): The name of the uploaded file.
+        username (str): The username of the admin who uploaded the file.
+
+    Returns:
+        int: The id of the new job.
+    """
+    job = ImportJob(filename=filename, created_by=username, status='queued')
+    db_session.add(job)
+    db_session.commit()
+    return job.id
+
+
+def update_job(job_id, **values):
+    """
+    Update the status, phase or counters of a job.
+
+    The update is committed on its own connection, so that the progress is
+    visible while the import transaction is still open.
+
+    Parameters:
+        job_id (int): The id of the job.
+        **values: The columns of the import_job table to update.
+    """
+    table = ImportJob.__table__
+    with db.engine.begin() as connection:
+        connection.execute(
+            table.update()
+            .where(table.c.id == job_id)
+            .values(updated_at=func.now(), **values))
+
+
+def get_job(job_id=None):
+    """
+    Return the job with the given id, or the latest job if no id is given.
+
+    Returns:
+        ImportJob: The job, or None if it does not exist.
+    """
+    # The job is updated by the worker on another connection: always reload it
+    order = select(ImportJob).execution_options(populate_existing=True)
+    if job_id is None:
+        order = order.order_by(ImportJob.id.desc()).limit(1)
+    else:
+        order = order.where(ImportJob.id == job_id)
+    return db_session.execute(order).scalars().first()
+
+
+def job_to_dict(job):
+    """Return the public fields of a job, ready to be sent as JSON."""
+    return {
+        'id': job.id,
+        'filename': job.filename,
+        'created_by': job.created_by,
+        'status': job.status,
+        'phase': job.phase,
+        'sessions_read': job.sessions_read,
+        'new_sessions': job.new_sessions,
+        'modified_sessions': job.modified_sessions,
+        'not_changed_sessions': job.not_changed_sessions,
+        'deleted_sessions': job.deleted_sessions,
+        'message': job.message,
+        'created_at': job.created_at.isoformat(),
+        'updated_at': job.updated_at.isoformat(),
+    }
+
+
+def submit(app, function, *args):
+    """
+    Run `function(*args)` in the import worker of the application.
+
+    If DATA_IMPORT_ASYNC is False (e.g. for the tests), the function is run
+    immediately in the current application context instead.
+
+    Parameters:
+        app (Flask): The application, whose context is pushed in the worker.
+        function (callable): The function to run.
+    """
+    if not app.config.get('DATA_IMPORT_ASYNC', True):
+        function(*args)
+        return
+
+    executor = app.extensions.get('import_executor')
+    if executor is None:
+        executor = ThreadPoolExecutor(
+            max_workers=app.config.get('DATA_IMPORT_WORKERS', 1),
+            thread_name_prefix='tutorlink-import')
+        app.extensions['import_executor'] = executor
+
+    executor.submit(_run_in_app_context, app, function, *args)
+
+
+def _run_in_app_context(app, function, *args):
+    """Run a job in its own application context (and thus its own database session)."""
+    with app.app_context():
+        try:
+            function(*args)
+        except Exception:
+            app.logger.exception("Import job failed")
+
+
+def fail_stale_jobs(stale_after):
+    """
+    Mark as failed the jobs left queued or running by a stopped worker, and delete their files.
+
+    A job is stale only if no import holds the import lock and it was not
+    updated for `stale_after` seconds: a job just queued by another worker,
+    or waiting for the lock, is left alone.
+
+    Parameters:
+        stale_after (float): The number of seconds without update of a stale job.
+
+    Returns:
+        list: The ids of the jobs marked as failed.
+    """
+    table = db.ImportJob.__table__
+    with db.engine.begin() as connection:
+        if not connection.execute(select(func.pg_try_advisory_xact_lock(IMPORT_LOCK_KEY))).scalar():
+            return []
+        job_ids = connection.execute(
+            table.update()
+            .where(table.c.status.in_(['queued', 'running']))
+            .where(table.c.updated_at < func.localtimestamp() - datetime.timedelta(seconds=stale_after))
+            .values(status='failed',
+                    message="The import was interrupted by a restart of the application.",
+                    updated_at=func.now())
+            .returning(table.c.id)).scalars().all()
+
+    for job_id in job_ids:
+        try:
+            os.remove(job_path(job_id))
+        except FileNotFoundError:
+            pass
+    return job_ids
+
+
+def init_app(app):
+    """Clean up the import jobs interrupted by a previous run of the application."""
+    # The import_job table is created by "flask db-migrate" on the older databases
+    if db.ImportJob is not None:
+        fail_stale_jobs(app.config.get('IMPORT_JOB_STALE_SECONDS', 600))
@@ -0,0 +1,143 @@
+import threading
+import time
+
+from flask import Blueprint
+from flask import abort
+from flask import current_app
+from flask import jsonify
+from sqlalchemy import event
+from sqlalchemy import exc
+from sqlalchemy.pool import NullPool
+from sqlalchemy.pool import QueuePool
+
+
+bp = Blueprint("metrics", __name__, url_prefix="/metrics")
+
+
+class PoolMetrics:
+    """Counters of the connection pool of an engine, shared by all the threads."""
+
+    def __init__(self, engine):
+        """
+        Parameters:
+            engine (Engine): The engine whose pool is measured.
+        """
+        self.engine = engine
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record_checkout(self, seconds, timed_out=False):
+        """Record the time spent waiting for a connection of the pool."""
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def record_connect(self):
+        """Record the opening of a new database connection."""
+        with self._lock:
+            self.connects += 1
+
+    def record_invalidation(self):
+        """Record a connection found broken (e.g. after a PostgreSQL restart)."""
+        with self._lock:
+            self.invalidations += 1
+
+    def to_dict(self):
+        """Return the counters and the current state of the pool, ready to be sent as JSON."""
+        pool = self.engine.pool
+        with self._lock:
+            result = {
+                'pool': type(pool).__name__,
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'connects': self.connects,
+                'invalidations': self.invalidations,
+                'wait_total': round(self.wait_total, 6),
+                'wait_max': round(self.wait_max, 6),
+                'wait_mean': round(self.wait_total / self.checkouts, 6) if self.checkouts else 0.0,
+            }
+        if isinstance(pool, QueuePool):
+            result.update({
+                'size': pool.size(),
+                'checked_in': pool.checkedin(),
+                'checked_out': pool.checkedout(),
+                'overflow': pool.overflow(),
+            })
+        return result
+
+
+class TimedPoolMixin:
+    """Pool which records in `self.metrics` the time spent to check out a connection."""
+
+    metrics = None
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            if self.metrics is not None:
+                self.metrics.record_checkout(time.perf_counter() - start, timed_out=True)
+            raise
+        if self.metrics is not None:
+            self.metrics.record_checkout(time.perf_counter() - start)
+        return connection
+
+    def recreate(self):
+        # engine.dispose() replaces the pool: keep the same counters
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedNullPool(TimedPoolMixin, NullPool):
+    pass
+
+
+def instrument_engine(engine):
+    """
+    Attach new metrics to the pool of an engine created with a timed pool class.
+
+    Parameters:
+        engine (Engine): The engine.
+
+    Returns:
+        PoolMetrics: The counters of the pool.
+    """
+    metrics = PoolMetrics(engine)
+    engine.pool.metrics = metrics
+    event.listen(engine, 'connect', lambda dbapi_connection, connection_record: metrics.record_connect())
+    event.listen(engine, 'invalidate', lambda dbapi_connection, connection_record, exception: metrics.record_invalidation())
+    return metrics
+
+
+@bp.route("/pool")
+def pool():
+    """
+    Return the metrics of the connection pool as JSON, for the monitoring.
+
+    The view does not use the database, so it answers even when the pool is
+    exhausted. It exposes the internals of the pool without login: it only
+    exists when METRICS_ENABLED is True, on a server whose /metrics is only
+    reachable by the monitoring.
+    """
+    if not current_app.config.get('METRICS_ENABLED', False):
+        abort(404)
+
+    result = current_app.extensions['pool_metrics'].to_dict()
+    if 'replica_pool_metrics' in current_app.extensions:
+        result['replica'] = current_app.extensions['replica_pool_metrics'].to_dict()
+    return jsonify(result)
@@ -6,9 +6,11 @@ from flask import render_template
 from flask import request
 from flask import url_for
 
-from tutorlink.db import db_session, Role
+from tutorlink.db import db_session, Role, User
 from sqlalchemy import select
-from tutorlink.auth import login_required
+from tutorlink import cache
+from tutorlink.auth import login_required, invalidate_user
+from tutorlink.calendar import feed_token, new_calendar_nonce
 
 bp = Blueprint("profile", __name__, url_prefix="/profile")
 
@@ -51,13 +53,20 @@ def profile():
             error += f"Role {role_id} does not exist. "
 
         if error == '':
-            g.user.email = email
-            g.user.name = name
-            g.user.surname = surname
-            g.user.role = role
+            user = db_session.execute(
+                select(User)
+                .where(User.username == g.user.username)
+            ).scalars().one()
+            user.email = email
+            user.name = name
+            user.surname = surname
+            user.role = role
 
-            db_session.add(g.user)
             db_session.commit()
+            invalidate_user(user.username)
+            # The name of the user is shown on the cards of their sessions
+            cache.session_cards.bump()
+            cache.data.bump()
 
             flash("Profile updated.", "success")
             return redirect(url_for("profile.profile"))
@@ -67,4 +76,28 @@ def profile():
     roles = db_session.execute(select(Role)).scalars()
     
     return render_template("profile/user.html",
-                            roles=roles)
+                            roles=roles,
+                            calendar_url=url_for("calendar.feed",
+                                                 token=feed_token(g.user.username, g.user.calendar_nonce),
+                                                 _external=True))
+
+
+@bp.route("/calendar/reset", methods=["POST"])
+@login_required
+def reset_calendar():
+    """
+    This view gives a new address to the calendar feed of the user.
+
+    The previous address, which may have been shared by mistake, stops
+    working at once.
+    """
+    user = db_session.execute(
+            select(User)
+            .where(User.username == g.user.username)
+        ).scalars().one()
+    user.calendar_nonce = new_calendar_nonce()
+    db_session.commit()
+    invalidate_user(user.username)
+
+    flash("Calendar address reset: update it in your calendar application.", "success")
+    return redirect(url_for("profile.profile"))
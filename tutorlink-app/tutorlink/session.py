@@ -1,56 +1,250 @@
+import base64
+import enum
 import math
-from flask import Blueprint, render_template, request, flash, redirect, g, url_for
+from flask import Blueprint, render_template, request, flash, redirect, g, url_for, get_template_attribute, jsonify, current_app
+from markupsafe import Markup
 
-from tutorlink.db import db_session, User, Session, Module, SessionType, LecturedBy, Ue
+from tutorlink.db import db_session, User, Session, Module, SessionType, LecturedBy, ManagedBy, Ue, session_card_options, read_only
+from tutorlink import cache
 from tutorlink.auth import login_required
-from sqlalchemy import select
+from sqlalchemy import select, func, tuple_, exists, literal, true
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
 from datetime import datetime
 
 bp = Blueprint("session", __name__, url_prefix="/session")
 
+# Number of sessions per page of the session list
+PAGE_SIZE = 12
+
 @bp.route("/list", methods=["GET"])
 @login_required
+@cache.conditional
+@read_only
 def session_list():
     """
     This view allows the user to list all the sessions.
     The user can filter the sessions by type, module, UE, dates.
     TODO: add groupes and rooms filters
 
-    The page is paginated with 12 sessions per page.
+    The page is paginated with PAGE_SIZE sessions per page: only the count
+    of the matching sessions and the sessions of the page are fetched.
+    The previous / next links carry a cursor on (date_start, id), so that
+    the neighbour page is found with an index seek instead of an OFFSET.
     TODO: add a filter to change the number of sessions per page
 
     User needs to be logged in to access this view.
     """
 
-    error = ""
-
     # Get all parameters from the request
     selected_page = request.args.get('page', 1, type=int)
+    filters, criteria, error = session_filters(request.args)
+
+    cursor = request.args.get('cursor', '')
+    direction = None
+    if cursor != '':
+        try:
+            direction, cursor_date_start, cursor_id = decode_cursor(cursor)
+        except ValueError:
+            error += "Invalid cursor. "
+
+    # Count the matching sessions, then fetch only the sessions of the page
+    nb_sessions = db_session.execute(
+        select(func.count(Session.id))
+        .where(*criteria)
+        ).scalar_one()
+    nb_pages = math.ceil(nb_sessions / PAGE_SIZE)
+    selected_page = max(min(selected_page, nb_pages), 1)
+
+    order = (select(Session)
+             .options(*session_card_options(Session))
+             .where(*criteria)
+             .limit(PAGE_SIZE))
+    position = tuple_(Session.date_start, Session.id)
+
+    if direction == 'next':
+        # Seek directly after the last session of the previous page
+        sessions = db_session.execute(
+            order
+            .where(position > tuple_(cursor_date_start, cursor_id))
+            .order_by(Session.date_start, Session.id)
+            ).scalars().all()
+    elif direction == 'prev':
+        # Seek directly before the first session of the next page
+        sessions = db_session.execute(
+            order
+            .where(position < tuple_(cursor_date_start, cursor_id))
+            .order_by(Session.date_start.desc(), Session.id.desc())
+            ).scalars().all()[::-1]
+    else:
+        sessions = db_session.execute(
+            order
+            .order_by(Session.date_start, Session.id)
+            .offset((selected_page - 1) * PAGE_SIZE)
+            ).scalars().all()
+
+    prev_url = None
+    next_url = None
+    if sessions and selected_page > 1:
+        prev_url = session_list_url(page=selected_page - 1,
+                                    cursor=encode_cursor('prev', sessions[0]))
+    if sessions and selected_page < nb_pages:
+        next_url = session_list_url(page=selected_page + 1,
+                                    cursor=encode_cursor('next', sessions[-1]))
+
+    # Get all modules, UE and session types for the filter
+    references = reference_data()
+
+    if error != "":
+        flash(error, "error")
+
+    return render_template("/session/session_list.html",
+                           sessions=sessions,
+                           modules=references['modules'],
+                           ues=references['ues'],
+                           session_types=references['session_types'],
+                           **filters,
+                           pages=pages_list(selected_page, nb_pages),
+                           current_page=selected_page,
+                           prev_url=prev_url,
+                           next_url=next_url,
+                           lectured_ids=lectured_session_ids(g.user.username, sessions))
+
+@bp.app_template_global()
+def session_card_parts(session):
+    """
+    Return the rendered parts of the card of a session which are the same for every user.
+
+    Only the register / unregister icon, between the title and the body, is
+    rendered for each request. Each part is a balanced HTML fragment. The
+    parts are cached by session id and lecturers (a registration changes the
+    key), until an import bumps cache.session_cards.
+
+    Parameters:
+        session (Session): The session, with its module, UE, type and lecturers loaded.
+
+    Returns:
+        dict: The 'title' and 'body' of the card, as Markup.
+    """
+    lecturers = ','.join(sorted(user.username for user in session.lectured_by_users))
+
+    def render():
+        return (str(get_template_attribute('session/session_cards.html', 'session_card_title')(session)),
+                str(get_template_attribute('session/session_cards.html', 'session_card_body')(session)))
+
+    title, body = cache.session_cards.get_or_set(f"{session.id}:{lecturers}", render)
+    return dict(title=Markup(title), body=Markup(body))
+
+def lectured_session_ids(username, sessions):
+    """
+    Return the ids of the given sessions lectured by a user.
+
+    The cards use it to choose between the register and unregister buttons
+    with a set lookup, instead of loading all the sessions of the user.
+
+    Parameters:
+        username (str): The username of the user.
+        sessions (list): The sessions shown on the page.
+
+    Returns:
+        frozenset: The ids of the sessions of `sessions` lectured by the user.
+    """
+    session_ids = [session.id for session in sessions]
+    if not session_ids:
+        return frozenset()
+
+    return frozenset(db_session.execute(
+        select(LecturedBy.session_id)
+        .where(LecturedBy.user_username == username)
+        .where(LecturedBy.session_id.in_(session_ids))
+        ).scalars())
 
-    type_ids = db_session.execute(select(SessionType.id)).scalars().all()
-    selected_types = [type_id for type_id in request.args.getlist('type') if type_id in type_ids]
+def encode_cursor(direction, session):
+    """
+    Return an opaque cursor pointing before or after a session of the list.
+
+    Parameters:
+        direction (str): 'prev' to list the sessions before `session`, 'next' for the ones after.
+        session (Session): The first (for 'prev') or last (for 'next') session of the current page.
+    """
+    position = f"{direction}|{session.date_start.isoformat()}|{session.id}"
+    return base64.urlsafe_b64encode(position.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor built by encode_cursor.
+
+    Returns:
+        tuple: The direction, the start date and the id of the session pointed by the cursor.
+
+    Raises:
+        ValueError: If the cursor is invalid.
+    """
+    padded = cursor + '=' * (-len(cursor) % 4)
+    direction, date_start, session_id = base64.urlsafe_b64decode(padded).decode('utf-8').split('|')
+    if direction not in ('prev', 'next'):
+        raise ValueError(f"Invalid cursor direction {direction}")
+    return direction, datetime.fromisoformat(date_start), int(session_id)
+
+def session_list_url(**args):
+    """Return the URL of the session list with the current filters and the given arguments."""
+    query = request.args.to_dict(flat=False)
+    query.update(args)
+    return url_for('session.session_list', **query)
+
+def reference_data():
+    """
+    Return the modules, UE and session types offered by the filters of the session list.
+
+    They only change on a Synapses import, so they are read once and kept
+    in cache.reference_data until the import bumps its version.
+
+    Returns:
+        dict: The lists of the 'modules', 'ues' and 'session_types', as dicts.
+    """
+    def load():
+        return {
+            'modules': [dict(id=module.id, name=module.name, label=module.label)
+                        for module in db_session.execute(select(Module).order_by(Module.id)).scalars()],
+            'ues': [dict(id=ue.id, name=ue.name, label=ue.label)
+                    for ue in db_session.execute(select(Ue).order_by(Ue.id)).scalars()],
+            'session_types': [dict(id=session_type.id, name=session_type.name)
+                              for session_type in db_session.execute(select(SessionType).order_by(SessionType.id)).scalars()],
+        }
+
+    return cache.reference_data.get_or_set('filters', load)
+
+def session_filters(args):
+    """
+    Read the filters of the session list from the request arguments.
+
+    Parameters:
+        args (MultiDict): The arguments of the request.
+
+    Returns:
+        filters (dict): The selected types, modules, UEs and dates, to fill the filter form.
+        criteria (list): The WHERE criteria on Session matching the filters.
+        error (str): The error messages about the invalid arguments.
+    """
+    error = ""
+    criteria = []
+
+    type_ids = [session_type['id'] for session_type in reference_data()['session_types']]
+    selected_types = [type_id for type_id in args.getlist('type') if type_id in type_ids]
 
     try:
-        selected_modules = [int(module_id) for module_id in request.args.getlist('module')]
+        selected_modules = [int(module_id) for module_id in args.getlist('module')]
     except ValueError:
         error += "Invalid type for modules. "
         selected_modules = []
     try:
-        selected_ues = [int(ue_id) for ue_id in request.args.getlist('ue')]
+        selected_ues = [int(ue_id) for ue_id in args.getlist('ue')]
     except ValueError:
         error += "Invalid type for UEs. "
         selected_ues = []
-    selected_date_min = request.args.get('date_min', datetime.now().strftime('%Y-%m-%d'))
-    selected_date_max = request.args.get('date_max', '')
+    selected_date_min = args.get('date_min', datetime.now().strftime('%Y-%m-%d'))
+    selected_date_max = args.get('date_max', '')
 
-    # Build the query
-    order = (select(Session)
-            .select_from(Session)
-            .join(Module, Module.id == Session.module_id)
-            .join(Ue, Ue.id == Session.ue_id)
-            .join(SessionType, SessionType.id == Session.type)
-            )
     if selected_date_max != '':
         try:
             selected_date_max = datetime.strptime(selected_date_max, '%Y-%m-%d').strftime('%Y-%m-%d')
@@ -58,7 +252,7 @@ def session_list():
             error += "Invalid date format for max date. "
             selected_date_max = None
         else:
-            order = order.where(Session.date_end <= selected_date_max)
+            criteria.append(Session.date_end <= selected_date_max)
     
     if selected_date_min != '':
         try:
@@ -67,43 +261,25 @@ def session_list():
             error += "Invalid date format for min date. "
             selected_date_min = None
         else:
-            order = order.where(Session.date_start >= selected_date_min)
+            criteria.append(Session.date_start >= selected_date_min)
 
+    # Every session has a type, a module and a UE: the foreign keys are filtered without joins
     if len(selected_types) > 0:
-        order = order.where(SessionType.id.in_(selected_types))
+        criteria.append(Session.type.in_(selected_types))
 
     if len(selected_modules) > 0:
-        order = order.where(Module.id.in_(selected_modules))
+        criteria.append(Session.module_id.in_(selected_modules))
     
     if len(selected_ues) > 0:
-        order = order.where(Ue.id.in_(selected_ues))
-
-    sessions = db_session.execute(order.order_by(Session.date_start)).scalars().all()
-    nb_sessions = len(sessions)
-    nb_pages = math.ceil(nb_sessions / 12)
-    sessions = sessions[(selected_page - 1) * 12 : selected_page * 12]
-    selected_page = max(min(selected_page, nb_pages), 1)
-
-    # Get all modules and session types for the filter
-    modules = db_session.execute(select(Module)).scalars()
-    ues = db_session.execute(select(Ue)).scalars()
-    session_types = db_session.execute(select(SessionType)).scalars()
+        criteria.append(Session.ue_id.in_(selected_ues))
 
-    if error != "":
-        flash(error, "error")
+    filters = dict(selected_types=selected_types,
+                   selected_modules=selected_modules,
+                   selected_ues=selected_ues,
+                   selected_date_min=selected_date_min,
+                   selected_date_max=selected_date_max)
 
-    return render_template("/session/session_list.html",
-                           sessions=sessions,
-                           modules=modules,
-                           ues=ues,
-                           session_types=session_types,
-                           selected_types=selected_types,
-                           selected_modules=selected_modules,
-                           selected_ues=selected_ues,
-                           selected_date_min=selected_date_min,
-                           selected_date_max=selected_date_max,
-                           pages=pages_list(selected_page, nb_pages),
-                           current_page=selected_page)
+    return filters, criteria, error
 
 def pages_list(page, nb_pages):
     """Return a list of pages to display in the pagination bar.
@@ -124,6 +300,85 @@ def pages_list(page, nb_pages):
     pages = beg + [page] + end
     return pages
 
+class Registration(enum.Enum):
+    """The outcomes of register_lecturer."""
+    REGISTERED = 'registered'
+    SESSION_NOT_FOUND = 'session_not_found'
+    USER_NOT_FOUND = 'user_not_found'
+    FORBIDDEN = 'forbidden'
+    ALREADY_REGISTERED = 'already_registered'
+
+
+def register_lecturer(session_id, username, actor):
+    """
+    Register a user as a lecturer of a session, on behalf of `actor`.
+
+    The registration is a single INSERT ... SELECT ... ON CONFLICT DO NOTHING
+    RETURNING statement, whose SELECT only returns a row if the session and
+    the user exist and the actor is allowed to register the user. Two
+    concurrent registrations can not fail with an IntegrityError: the second
+    one inserts nothing. Only when nothing is inserted, a second query finds
+    out why.
+
+    Parameters:
+        session_id (int): The id of the session.
+        username (str): The username of the user to register.
+        actor (UserSnapshot): The logged-in user. They can register themselves;
+            admins and managers of the module of the session can register anyone.
+
+    Returns:
+        list: [Registration.REGISTERED] (committed) or the reasons of the failure, in the order
+            of the error messages of the view.
+    """
+    session_table = Session.__table__
+    user_table = User.__table__
+    lectured_by_table = LecturedBy.__table__
+    managed_by_table = ManagedBy.__table__
+
+    manages_module = (
+        exists()
+        .where(managed_by_table.c.module_id == session_table.c.module_id)
+        .where(managed_by_table.c.user_username == actor.username))
+    allowed = username == actor.username or actor.admin
+
+    # The session and the user are independent rows: join them explicitly on true
+    source = (select(session_table.c.id, user_table.c.username, literal(False))
+              .select_from(session_table.join(user_table, true()))
+              .where(session_table.c.id == session_id)
+              .where(user_table.c.username == username))
+    if not allowed:
+        source = source.where(manages_module)
+
+    inserted = db_session.execute(
+        pg_insert(lectured_by_table)
+        .from_select(['session_id', 'user_username', 'synapse'], source)
+        .on_conflict_do_nothing()
+        .returning(lectured_by_table.c.session_id)).first()
+    db_session.commit()
+
+    if inserted is not None:
+        return [Registration.REGISTERED]
+
+    # Nothing inserted: find out why, in one query
+    diagnostic = db_session.execute(select(
+        exists().where(session_table.c.id == session_id).label('session'),
+        exists().where(user_table.c.username == username).label('user'),
+        (exists().where(session_table.c.id == session_id).where(manages_module)).label('manager'),
+        )).one()
+
+    outcomes = []
+    if not diagnostic.session:
+        outcomes.append(Registration.SESSION_NOT_FOUND)
+    if not diagnostic.user:
+        outcomes.append(Registration.USER_NOT_FOUND)
+    if not outcomes and not (allowed or diagnostic.manager):
+        outcomes.append(Registration.FORBIDDEN)
+    if not outcomes:
+        # The conflicting row may have been deleted since the INSERT: still a duplicate
+        outcomes.append(Registration.ALREADY_REGISTERED)
+    return outcomes
+
+
 @bp.route("/register", methods=["POST"])
 @login_required
 def session_register():
@@ -145,56 +400,34 @@ def session_register():
             session_id = int(session_id)
         except ValueError:
             error += "Invalid session id. "
+            outcomes = []
+            if db_session.execute(select(User.username).where(User.username == username)).first() is None:
+                error += "Invalid username. "
         else:
-            session = db_session.execute(
-                select(Session)
-                .where(Session.id == session_id)
-                ).scalars().first()
+            outcomes = register_lecturer(session_id, username, g.user)
 
-            if session is None:
+        for outcome in outcomes:
+            if outcome is Registration.SESSION_NOT_FOUND:
                 error += f"The session with id {session_id} does not exist. "
-        
-        user = db_session.execute(
-            select(User)
-            .where(User.username == username)
-            ).scalars().first()
-
-        if user is None:
-            error += "Invalid username. "
-
-        if (error == ""
-            and user.username != g.user.username
-            and g.user.admin == False
-            and session.module not in g.user.managed_modules):
-
-            error += "You are not allowed to register other users. "
-
-        if (error == ""
-            and db_session.execute(
-                select(LecturedBy)
-                .where(LecturedBy.session_id == session_id)
-                .where(LecturedBy.user_username == username)
-                ).scalars().first() is not None):
-
-            error += f"{username} is already registered for this session. "
+            elif outcome is Registration.USER_NOT_FOUND:
+                error += "Invalid username. "
+            elif outcome is Registration.FORBIDDEN:
+                error += "You are not allowed to register other users. "
+            elif outcome is Registration.ALREADY_REGISTERED:
+                error += f"{username} is already registered for this session. "
 
         if error == "":
-            session_lecturer = LecturedBy(session_id=session_id,
-                                        user_username=username,
-                                        synapse=False)
-            db_session.add(session_lecturer)
-            db_session.commit()
-            if user.username == g.user.username:
-                flash("You have successfully registered for the session.", 'success')
+            cache.open_sessions.invalidate()
+            cache.data.bump()
+            cache.calendars.bump(username)
+            if username == g.user.username:
+                message = "You have successfully registered for the session."
             else:
-                flash(f"{username} has successfully been registered for the session.", 'success')
+                message = f"{username} has successfully been registered for the session."
         else:
-            flash(error, 'error')
-    
-    if request.referrer is None:
-        return redirect(url_for('index'))
+            message = None
 
-    return redirect(request.referrer)
+        return registration_response(session_id, message, error)
 
 
 @bp.route("/unregister", methods=["POST"])
@@ -238,7 +471,7 @@ def session_unregister():
 
         if (user.username != g.user.username
             and g.user.admin == False
-            and session.module not in g.user.managed_modules):
+            and session.module_id not in g.user.managed_module_ids):
 
             error += "You are not allowed to unregister other users. "
 
@@ -259,15 +492,211 @@ def session_unregister():
                 ).scalars().first()
             
             db_session.delete(session_lecturer)
+            if session_lecturer.synapse:
+                # Forget the Synapses fingerprint so that the next import restores the lecturer
+                session.fingerprint = None
             db_session.commit()
+            cache.open_sessions.invalidate()
+            cache.data.bump()
+            cache.calendars.bump(username)
             if user.username == g.user.username:
-                flash("You have successfully unregistered from the session.", 'success')
+                message = "You have successfully unregistered from the session."
             else:
-                flash(f"{username} has successfully been unregistered from the session.", 'success')
+                message = f"{username} has successfully been unregistered from the session."
         else:
-            flash(error, 'error')
-    
+            message = None
+
+        return registration_response(session_id, message, error)
+
+
+def wants_json():
+    """Return whether the client asked for JSON, like the fetch calls of the session cards."""
+    return request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json'
+
+
+def registration_response(session_id, message, error):
+    """
+    Answer a register / unregister request.
+
+    The fetch calls of the cards get the message and the card of the session,
+    rendered again for the logged-in user, so that only this card is replaced
+    in the page. The form submissions get a flash message and are redirected
+    to the referring page.
+
+    Parameters:
+        session_id (int): The id of the session.
+        message (str): The success message, None if the request failed.
+        error (str): The error messages, "" if the request succeeded.
+    """
+    if wants_json():
+        if error != "":
+            return jsonify(message=error.strip(), category='error'), 400
+
+        session = db_session.execute(
+            select(Session)
+            .options(*session_card_options(Session))
+            .where(Session.id == session_id)
+            ).scalars().one()
+        # The lecturers are loaded with the card: no query is needed to place the buttons
+        lectured_ids = frozenset(session.id for user in session.lectured_by_users
+                                 if user.username == g.user.username)
+        card = get_template_attribute('session/session_cards.html', 'session_card')(session, lectured_ids)
+        return jsonify(message=message, category='success', session_id=session_id, card=str(card))
+
+    if error != "":
+        flash(error, 'error')
+    else:
+        flash(message, 'success')
+
     if request.referrer is None:
         return redirect(url_for('index'))
 
     return redirect(request.referrer)
+
+
+@bp.route("/bulk", methods=["POST"])
+@login_required
+def session_bulk():
+    """
+    Register and unregister many lecturers at once, e.g. to staff a whole module.
+
+    The request body is JSON:
+        {"register": [{"session_id": 1, "username": "jdoe"}, ...],
+         "unregister": [{"session_id": 2, "username": "jdoe"}, ...]}
+
+    The rules are those of session_register and session_unregister. Every
+    pair is checked first: if any pair is invalid, nothing is changed and
+    the errors are returned with a 400 status. Otherwise all the changes
+    are committed in one transaction.
+
+    User needs to be logged in to access this route.
+    """
+    body = request.get_json(silent=True)
+    try:
+        register_pairs = read_pairs(body, 'register')
+        unregister_pairs = read_pairs(body, 'unregister')
+    except ValueError as e:
+        return jsonify(errors=[str(e)]), 400
+
+    max_pairs = current_app.config.get('BULK_MAX_PAIRS', 500)
+    if len(register_pairs) + len(unregister_pairs) > max_pairs:
+        return jsonify(errors=[f"Too many changes, the maximum is {max_pairs}. "]), 400
+
+    errors = bulk_update_lecturers(register_pairs, unregister_pairs, g.user)
+    if errors:
+        return jsonify(errors=errors), 400
+
+    cache.open_sessions.invalidate()
+    cache.data.bump()
+    for username in {username for _, username in register_pairs + unregister_pairs}:
+        cache.calendars.bump(username)
+    return jsonify(registered=[dict(session_id=s, username=u) for s, u in register_pairs],
+                   unregistered=[dict(session_id=s, username=u) for s, u in unregister_pairs])
+
+def read_pairs(body, key):
+    """
+    Read the (session id, username) pairs of a bulk request.
+
+    Raises:
+        ValueError: If the body is not a JSON object or a pair is malformed.
+    """
+    if not isinstance(body, dict):
+        raise ValueError("The body must be a JSON object. ")
+
+    items = body.get(key, [])
+    if not isinstance(items, list):
+        raise ValueError(f"{key} must be a list. ")
+
+    pairs = []
+    for item in items:
+        if not isinstance(item, dict) or 'session_id' not in item or 'username' not in item:
+            raise ValueError(f"Each {key} item needs a session_id and a username. ")
+        session_id = item['session_id']
+        username = item['username']
+        if not isinstance(session_id, int) or isinstance(session_id, bool) or not isinstance(username, str):
+            raise ValueError(f"Invalid session id or username in {key}: {item}. ")
+        pairs.append((session_id, username))
+    return list(dict.fromkeys(pairs))
+
+def bulk_update_lecturers(register_pairs, unregister_pairs, actor):
+    """
+    Check and apply many registrations and unregistrations in one transaction.
+
+    The checks use one query per table (sessions, users, modules managed by
+    the actor, existing registrations), whatever the number of pairs.
+
+    Parameters:
+        register_pairs (list): The (session id, username) pairs to register.
+        unregister_pairs (list): The (session id, username) pairs to unregister.
+        actor (UserSnapshot): The logged-in user.
+
+    Returns:
+        list: The error messages, empty if the changes were committed.
+    """
+    pairs = register_pairs + unregister_pairs
+    if not pairs:
+        return []
+    session_ids = {session_id for session_id, _ in pairs}
+    usernames = {username for _, username in pairs}
+
+    session_modules = dict(db_session.execute(
+        select(Session.id, Session.module_id)
+        .where(Session.id.in_(session_ids))).all())
+    existing_users = set(db_session.execute(
+        select(User.username)
+        .where(User.username.in_(usernames))).scalars())
+    managed_module_ids = set(db_session.execute(
+        select(ManagedBy.module_id)
+        .where(ManagedBy.user_username == actor.username)).scalars())
+    registrations = {(row.session_id, row.user_username): row.synapse
+                     for row in db_session.execute(
+                         select(LecturedBy.session_id, LecturedBy.user_username, LecturedBy.synapse)
+                         .where(LecturedBy.session_id.in_(session_ids))
+                         .where(LecturedBy.user_username.in_(usernames)))}
+
+    errors = []
+    for action, action_pairs in (('register', register_pairs), ('unregister', unregister_pairs)):
+        for session_id, username in action_pairs:
+            error = ""
+            if session_id not in session_modules:
+                error += f"The session with id {session_id} does not exist. "
+            if username not in existing_users:
+                error += "Invalid username. "
+            if (error == ""
+                and username != actor.username
+                and not actor.admin
+                and session_modules[session_id] not in managed_module_ids):
+                error += f"You are not allowed to {action} other users. "
+            if error == "" and action == 'register' and (session_id, username) in registrations:
+                error += f"{username} is already registered for this session. "
+            if error == "" and action == 'unregister' and (session_id, username) not in registrations:
+                error += f"{username} is not registered for this session. "
+            if error != "":
+                errors.append(f"{action} {username} / session {session_id}: {error.strip()}")
+
+    if errors:
+        return errors
+
+    lectured_by_table = LecturedBy.__table__
+    session_table = Session.__table__
+    if register_pairs:
+        db_session.execute(
+            pg_insert(lectured_by_table)
+            .values([dict(session_id=session_id, user_username=username, synapse=False)
+                     for session_id, username in register_pairs])
+            .on_conflict_do_nothing())
+    if unregister_pairs:
+        db_session.execute(
+            lectured_by_table.delete()
+            .where(tuple_(lectured_by_table.c.session_id, lectured_by_table.c.user_username)
+                   .in_(unregister_pairs)))
+        # Forget the Synapses fingerprints so that the next import restores the lecturers
+        synapse_session_ids = {session_id for session_id, username in unregister_pairs
+                               if registrations[(session_id, username)]}
+        if synapse_session_ids:
+            db_session.execute(
+                session_table.update()
+                .where(session_table.c.id.in_(synapse_session_ids))
+                .values(fingerprint=None))
+    db_session.commit()
+    return []